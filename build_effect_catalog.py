@@ -0,0 +1,193 @@
+# 효과 카탈로그 빌드: 모든 효과 이름.txt + config.json(effect_weights) + main.lua → effect_catalog.json / .lua
+#
+# - 효과마다 고정 숫자 ID 부여 (기존 effect_catalog.json이 있으면 ID 유지, 새 효과는 next_id부터)
+# - 불일치(핸들러 없는 효과, 오타 난 가중치 키 등)는 여기서 실패 처리 → 방송 중에 발견되지 않도록
+# - 봇은 effect_catalog.json을 읽어 결과를 ID로 발행하고, main.lua는 effect_catalog.lua로 ID → 핸들러를 찾음
+# - main.lua는 에뮬레이터 작업 폴더(= config.json save_dir) 기준으로 dofile 하므로 .lua는 save_dir에 씀
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_WEIGHT = 10
+CATALOG_VERSION = 1
+
+# ================= 입력 파서 =================
+def read_effect_names(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+def read_effect_weights(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("effect_weights", {}) or {}
+
+def read_save_dir(path):
+    """config.json의 save_dir (에뮬레이터 작업 폴더). 없으면 None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("save_dir") or None
+
+def _lua_table_block(source, header):
+    """'local name = {' 부터 짝이 맞는 '}' 까지 (문자열 안의 괄호는 무시)"""
+    start = source.find(header)
+    if start < 0:
+        return ""
+    i = source.index("{", start)
+    depth, in_str = 0, None
+    while i < len(source):
+        c = source[i]
+        if in_str:
+            if c == "\\":
+                i += 1
+            elif c == in_str:
+                in_str = None
+        elif c in "\"'":
+            in_str = c
+        elif c == "-" and source.startswith("--", i):
+            i = source.find("\n", i)
+            if i < 0:
+                break
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return source[start:i + 1]
+        i += 1
+    return source[start:]
+
+def read_lua_tables(path):
+    """main.lua에서 (한글→영문 매핑, 핸들러 이름 집합) 추출"""
+    with open(path, encoding="utf-8") as f:
+        source = f.read()
+    mapping_block = _lua_table_block(source, "local effect_kor_to_eng")
+    handlers_block = _lua_table_block(source, "local effects")
+    mapping = dict(re.findall(r'\[\s*"([^"]+)"\s*\]\s*=\s*"([^"]+)"', mapping_block))
+    handlers = set(re.findall(r'^\s*\[\s*"([^"]+)"\s*\]\s*=\s*function', handlers_block, re.MULTILINE))
+    return mapping, handlers
+
+# ================= 빌드 =================
+def build_catalog(names, weights, mapping, handlers, previous=None):
+    """(catalog, errors, warnings) 반환. errors가 있으면 catalog는 None"""
+    errors, warnings = [], []
+
+    seen = set()
+    for n in names:
+        if n in seen:
+            errors.append(f"효과 이름 중복: {n}")
+        seen.add(n)
+    for n in names:
+        eng = mapping.get(n)
+        if eng is None:
+            errors.append(f"main.lua effect_kor_to_eng에 없는 효과: {n}")
+        elif eng not in handlers:
+            errors.append(f"main.lua effects에 핸들러가 없는 효과: {n} → {eng}")
+    for key, w in weights.items():
+        if key not in seen:
+            errors.append(f"config.json effect_weights에 알 수 없는 효과: {key}")
+        elif not isinstance(w, (int, float)) or w < 0:
+            errors.append(f"잘못된 가중치: {key}={w!r}")
+    for kor in sorted(set(mapping) - seen):
+        warnings.append(f"효과 목록에 없는 매핑(사용 안 됨): {kor}")
+    for eng in sorted(handlers - set(mapping.values())):
+        warnings.append(f"매핑되지 않은 핸들러(사용 안 됨): {eng}")
+    if errors:
+        return None, errors, warnings
+
+    # 기존 ID 유지, 새 효과는 next_id부터 (삭제된 ID는 재사용하지 않음)
+    prev_ids = {}
+    next_id = 1
+    if previous:
+        prev_ids = {e["name"]: e["id"] for e in previous.get("effects", [])}
+        next_id = int(previous.get("next_id", max(prev_ids.values(), default=0) + 1))
+    effects = []
+    for n in names:
+        eid = prev_ids.get(n)
+        if eid is None:
+            eid = next_id
+            next_id += 1
+        effects.append({
+            "id": eid,
+            "name": n,
+            "handler": mapping[n],
+            "weight": weights.get(n, DEFAULT_WEIGHT),
+        })
+    catalog = {
+        "version": CATALOG_VERSION,
+        "generated_at": int(time.time()),
+        "next_id": next_id,
+        "effects": effects,
+    }
+    return catalog, errors, warnings
+
+def _lua_str(s):
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+def render_lua(catalog):
+    lines = [
+        "-- 자동 생성: build_effect_catalog.py (직접 수정하지 마세요)",
+        "-- [ID] = { name = 표시 이름, handler = main.lua effects 키 }",
+        "return {",
+    ]
+    for e in sorted(catalog["effects"], key=lambda e: e["id"]):
+        lines.append(f"    [{e['id']}] = {{ name = {_lua_str(e['name'])}, handler = {_lua_str(e['handler'])} }},")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def _write_text(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="\n") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="효과 카탈로그(effect_catalog.json/.lua) 빌드")
+    ap.add_argument("--effects", default=os.path.join(APP_DIR, "모든 효과 이름.txt"))
+    ap.add_argument("--config", default=os.path.join(APP_DIR, "config.json"))
+    ap.add_argument("--lua", default=os.path.join(APP_DIR, "main.lua"))
+    ap.add_argument("--out-dir", default=APP_DIR, help="effect_catalog.json 위치 (봇 폴더)")
+    ap.add_argument("--lua-dir", default=None, help="effect_catalog.lua 위치 (기본: config.json save_dir)")
+    args = ap.parse_args(argv)
+
+    lua_dir = args.lua_dir or read_save_dir(args.config)
+    if not lua_dir:
+        lua_dir = args.out_dir
+        print(f"[경고] config.json에 save_dir가 없어 effect_catalog.lua를 {lua_dir}에 씁니다 "
+              "- main.lua는 에뮬레이터 작업 폴더에서 읽으므로 그곳으로 옮겨야 합니다")
+    elif not os.path.isdir(lua_dir):
+        print(f"❌ effect_catalog.lua를 쓸 폴더가 없습니다: {lua_dir}")
+        return 1
+
+    json_path = os.path.join(args.out_dir, "effect_catalog.json")
+    lua_path = os.path.join(lua_dir, "effect_catalog.lua")
+    previous = None
+    if os.path.exists(json_path):
+        with open(json_path, encoding="utf-8") as f:
+            previous = json.load(f)
+
+    names = read_effect_names(args.effects)
+    weights = read_effect_weights(args.config)
+    mapping, handlers = read_lua_tables(args.lua)
+    catalog, errors, warnings = build_catalog(names, weights, mapping, handlers, previous)
+
+    for w in warnings:
+        print("[경고]", w)
+    if errors:
+        for e in errors:
+            print("❌", e)
+        print(f"카탈로그 빌드 실패: 오류 {len(errors)}건 (파일을 쓰지 않았습니다)")
+        return 1
+
+    _write_text(json_path, json.dumps(catalog, ensure_ascii=False, indent=2) + "\n")
+    _write_text(lua_path, render_lua(catalog))
+    print(f"✅ 효과 {len(catalog['effects'])}개 → {json_path}, {lua_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
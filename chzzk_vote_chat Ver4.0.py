@@ -1,5 +1,6 @@
 # chzzk_vote_chat_optimized.py — 1000명 규모 최적화 버전
 
+import re
 import json
 import threading
 import requests
@@ -7,8 +8,20 @@ import random
 import os
 import time
 import sys
+import socket
 import logging
-from collections import deque
+import logging.handlers
+import queue
+import copy
+import atexit
+import sqlite3
+import hashlib
+import heapq
+from array import array
+from collections import deque, OrderedDict
+
+# 다른 스크립트(headless_consumer.py 등)가 모듈로 불러온 경우: 입력 대기/로그 설정 없이 바로 예외로 알림
+_AS_LIBRARY = __name__ != "__main__"
 
 # -------------------------
 # 의존성 확인
@@ -16,6 +29,8 @@ from collections import deque
 try:
     import socketio  # python-socketio
 except Exception as _imp_err:
+    if _AS_LIBRARY:
+        raise ImportError("python-socketio 클라이언트가 필요합니다: pip install python-socketio[client] requests") from _imp_err
     print("[치명적] python-socketio 클라이언트가 설치되지 않았습니다.")
     print("설치 명령: pip install python-socketio[client] requests")
     print("원인:", repr(_imp_err))
@@ -24,15 +39,177 @@ except Exception as _imp_err:
 
 # -------------------------
 # 로깅 설정 (운영 환경 최적화)
+# - 호출 스레드(채팅 콜백)는 필터 + 큐 적재만, 콘솔/파일 I/O는 백그라운드 writer가 처리
+# - 파일 출력은 회전되는 JSON-lines
 # -------------------------
 LOG_LEVEL = os.getenv("CHZZK_LOG", "WARNING").upper()  # INFO → WARNING
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL, logging.WARNING),
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%H:%M:%S",
-)
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+LOG_DATEFMT = "%H:%M:%S"
+LOG_QUEUE_MAX = 10000
+
+# 메시지 종류(포맷 문자열 접두어)별 샘플링 비율. config.json의 log_sampling으로 덮어쓰기 가능
+DEFAULT_LOG_SAMPLING = {
+    "📥 [on_chat 수신됨]": 0.01,
+    "🗳️ 투표 성공": 0.1,
+    "🗳️ 찬성 투표": 0.1,
+}
+
 logger = logging.getLogger("chzzk")
 
+class _JsonLineFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        return json.dumps(entry, ensure_ascii=False)
+
+class _LogGate(logging.Filter):
+    """
+    호출 스레드에서 도는 필터 (I/O 없음)
+    - ERROR 이상: (메시지, 예외 타입)별로 window 초당 burst 개까지만 통과, 나머지는 개수만 셈
+      (window가 끝나면 억제 수를 WARNING 한 줄로 남김 - 같은 오류가 다시 오지 않아도, 종료 시에도)
+    - 그 외: 샘플링 대상 메시지는 N개 중 1개만 통과
+    """
+    def __init__(self, sampling, burst=5, window=60.0):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self._prefix_every = {}
+        for prefix, rate in (sampling or {}).items():
+            rate = float(rate)
+            self._prefix_every[prefix] = 0 if rate <= 0 else max(1, round(1 / min(rate, 1.0)))
+        self._every_cache = {}  # 포맷 문자열 -> N (None이면 샘플링 대상 아님)
+        self._seen = {}
+        self._errors = {}  # (포맷 문자열, 예외 타입) -> [window 시작, 통과 수, 억제 수]
+        self._sweep_every = min(self.window, 5.0)
+        self._next_sweep = 0.0
+        self._lock = threading.Lock()
+
+    def _every(self, template):
+        try:
+            return self._every_cache[template]
+        except KeyError:
+            every = None
+            for prefix, n in self._prefix_every.items():
+                if template.startswith(prefix):
+                    every = n
+                    break
+            self._every_cache[template] = every
+            return every
+
+    def _sweep(self, now, final):
+        """window가 끝난(final이면 전부) 오류 키를 정리하고 남은 억제 수 [(포맷 문자열, 예외 타입, 수)] 반환"""
+        pending = []
+        with self._lock:
+            if not final and now < self._next_sweep:
+                return pending
+            self._next_sweep = now + self._sweep_every
+            for key, st in list(self._errors.items()):
+                if final or now - st[0] >= self.window:
+                    del self._errors[key]
+                    if st[2]:
+                        pending.append((key[0], key[1], st[2]))
+        return pending
+
+    def report_suppressed(self, now=None, final=False):
+        for template, exc_type, n in self._sweep(time.time() if now is None else now, final):
+            logger.warning("[로그] 같은 오류 %d건 억제됨 (%s): %s", n,
+                           exc_type.__name__ if exc_type else "-", template, extra={"suppressed": n})
+
+    def filter(self, record):
+        template = record.msg if isinstance(record.msg, str) else ""
+        if self._errors and record.created >= self._next_sweep:
+            self.report_suppressed(record.created)  # 요약 기록도 이 필터를 지나지만 다음 sweep 전이라 바로 통과
+        if record.levelno >= logging.ERROR:
+            key = (template, record.exc_info[0] if record.exc_info else None)
+            with self._lock:
+                st = self._errors.get(key)
+                if st is None or record.created - st[0] >= self.window:
+                    if st and st[2]:
+                        record.suppressed = st[2]
+                    self._errors[key] = [record.created, 1, 0]
+                    return True
+                if st[1] < self.burst:
+                    st[1] += 1
+                    return True
+                st[2] += 1
+                return False
+        every = self._every(template)
+        if every is None:
+            return True
+        if every == 0:
+            return False
+        with self._lock:
+            n = self._seen.get(template, 0)
+            self._seen[template] = n + 1
+        return n % every == 0
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """큐가 가득 차면 기다리지 않고 버림(개수만 셈). traceback 포맷은 writer 스레드로 미룸"""
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def setup_logging(log_dir=None, sampling=None, max_bytes=5 * 1024 * 1024, backups=5,
+                  error_burst=5, error_window=60.0):
+    """루트 로거를 큐 → 백그라운드 writer(콘솔 + JSON-lines 회전 파일) 구성으로 교체"""
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+    handlers = [console]
+    if log_dir:
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            fh = logging.handlers.RotatingFileHandler(
+                os.path.join(log_dir, "chzzk_vote.jsonl"),
+                maxBytes=max_bytes, backupCount=backups, encoding="utf-8",
+            )
+            fh.setFormatter(_JsonLineFormatter())
+            handlers.append(fh)
+        except OSError as e:
+            print("[경고] 로그 파일을 열 수 없어 콘솔만 사용합니다:", e)
+
+    q = queue.Queue(maxsize=LOG_QUEUE_MAX)
+    qh = _NonBlockingQueueHandler(q)
+    gate = _LogGate(sampling, burst=error_burst, window=error_window)
+    qh.addFilter(gate)
+    listener = logging.handlers.QueueListener(q, *handlers, respect_handler_level=True)
+
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(qh)
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.WARNING))
+    listener.start()
+
+    def _stop():
+        gate.report_suppressed(final=True)
+        listener.stop()
+        if qh.dropped:
+            print(f"[로그] 큐 포화로 버려진 로그 {qh.dropped}건")
+    atexit.register(_stop)
+    return qh, listener
+
 # -------------------------
 # 유틸: PyInstaller 경로
 # -------------------------
@@ -41,35 +218,73 @@ def resource_path(relative_path):
         return os.path.join(sys._MEIPASS, relative_path)
     return os.path.join(os.path.abspath(os.path.dirname(__file__)), relative_path)
 
+def load_effect_catalog(path):
+    """build_effect_catalog.py가 만든 카탈로그의 효과 목록. 없으면 None (txt + config 가중치로 동작)"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("effects") or None
+
+def read_effect_names(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
 # ======== 경로/파일 상수 ========
 EFFECT_NAMES_FILE = resource_path("모든 효과 이름.txt")
+EFFECT_CATALOG_FILE = resource_path("effect_catalog.json")
 CONFIG_FILE = resource_path("config.json")
 TOKEN_FILE = resource_path("access_token.json")
+IDENTITY_FILE = os.path.splitext(TOKEN_FILE)[0] + ".identity.json"  # 토큰 주인 채널 캐시
 
 # ======== 저장 위치 설정 (UI 연동) ========
 try:
     cfg = json.load(open(CONFIG_FILE, encoding="utf-8"))
     SAVE_DIR = cfg.get("save_dir", os.path.abspath(os.path.dirname(__file__)))
 except Exception:
+    cfg = {}
     SAVE_DIR = os.path.abspath(os.path.dirname(__file__))
 
+# ======== 로깅 파이프라인 시작 (저장 폴더가 있을 때만 파일 로그, 모듈로 불러온 경우는 호출한 쪽 설정) ========
+_log_sampling = dict(DEFAULT_LOG_SAMPLING)
+_log_sampling.update(cfg.get("log_sampling") or {})
+if not _AS_LIBRARY:
+    setup_logging(
+        log_dir=cfg.get("log_dir") or (os.path.join(SAVE_DIR, "logs") if os.path.isdir(SAVE_DIR) else None),
+        sampling=_log_sampling,
+        max_bytes=int(cfg.get("log_max_bytes", 5 * 1024 * 1024)),
+        backups=int(cfg.get("log_backups", 5)),
+        error_burst=int(cfg.get("log_error_burst", 5)),
+        error_window=float(cfg.get("log_error_window", 60)),
+    )
+
+def _read_json(path, default=None):
+    """JSON 파일 읽기. default가 주어졌고 파일이 없으면 default"""
+    if default is not None and not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
 # ======== 설정값 불러오기 & 예외 처리 ========
+# 모듈로 불러온 경우 config/토큰은 없어도 기본값으로 진행 (결과 기록/라운드 루프만 쓰는 도구용),
+# 저장 폴더는 호출한 쪽이 save_dir로 따로 넘긴다
 try:
-    if not os.path.isdir(SAVE_DIR):
+    if not os.path.isdir(SAVE_DIR) and not _AS_LIBRARY:
         logger.error("폴더가 없습니다: %s", SAVE_DIR)
         input("폴더 생성 또는 경로 설정 후 다시 실행하세요. 엔터로 종료.")
         sys.exit(1)
 
-    with open(EFFECT_NAMES_FILE, "r", encoding="utf-8") as f:
-        all_effects = [line.strip() for line in f if line.strip()]
+    effect_catalog = load_effect_catalog(EFFECT_CATALOG_FILE)
+    effect_names = None  # 카탈로그가 있어도 txt가 있으면 읽어서 어긋났는지 확인
+    if not effect_catalog or os.path.exists(EFFECT_NAMES_FILE):
+        effect_names = read_effect_names(EFFECT_NAMES_FILE)
+    all_effects = [e["name"] for e in effect_catalog] if effect_catalog else effect_names
 
-    with open(CONFIG_FILE, encoding="utf-8") as f:
-        config = json.load(f)
-
-    with open(TOKEN_FILE, encoding="utf-8") as f:
-        token_data = json.load(f)
+    config = _read_json(CONFIG_FILE, {} if _AS_LIBRARY else None)
+    token_data = _read_json(TOKEN_FILE, {} if _AS_LIBRARY else None)
 
 except Exception as e:
+    if _AS_LIBRARY:
+        raise RuntimeError(f"봇 필수 파일을 읽을 수 없습니다: {e}") from e
     logger.exception("[필수 파일 읽기/경로 오류]: %s", e)
     input("필수 파일이 없거나 잘못되었습니다. 엔터를 눌러 종료.")
     sys.exit(1)
@@ -82,9 +297,116 @@ RESULT_DURATION = int(config.get("result_duration", 60))
 NEXT_VOTE_WAIT = int(config.get("vote_cooldown", 150))
 RUNTIME = int(config.get("runtime", 3 * 60 * 60))
 EFFECT_WEIGHTS = config.get("effect_weights", {})
+EFFECT_IDS = {}  # 효과 이름 -> 카탈로그 ID (카탈로그가 없으면 비어 있고 이름으로만 발행)
+if effect_catalog:
+    EFFECT_IDS = {e["name"]: e["id"] for e in effect_catalog}
+    if effect_names is not None and set(effect_names) != set(EFFECT_IDS):
+        logger.error("모든 효과 이름.txt가 effect_catalog.json과 다릅니다 (txt에만: %s / 카탈로그에만: %s). "
+                     "build_effect_catalog.py를 다시 실행하세요.",
+                     [n for n in effect_names if n not in EFFECT_IDS] or "-",
+                     [n for n in EFFECT_IDS if n not in set(effect_names)] or "-")
+        if not _AS_LIBRARY:
+            input("카탈로그를 다시 만든 뒤 실행하세요. 엔터로 종료.")
+            sys.exit(1)
+    _catalog_weights = {e["name"]: e["weight"] for e in effect_catalog}
+    if any(_catalog_weights.get(k) != v for k, v in EFFECT_WEIGHTS.items()):
+        logger.warning("config.json effect_weights가 카탈로그와 다릅니다. build_effect_catalog.py를 다시 실행하세요.")
+    EFFECT_WEIGHTS = _catalog_weights
+else:
+    logger.warning("effect_catalog.json이 없어 효과 이름으로 결과를 발행합니다 (build_effect_catalog.py 권장)")
+ACK_FILE = os.path.join(SAVE_DIR, "vote_ack.txt")
+ACK_TIMEOUT = int(config.get("ack_timeout", RESULT_DURATION))
+HISTORY_DB = config.get("history_db", os.path.join(SAVE_DIR, "vote_history.sqlite3"))
+HISTORY_WEIGHTING = bool(config.get("history_weighting", False))
+HISTORY_WINDOW = int(config.get("history_window", 500))
+FLOOD_WINDOW = float(config.get("flood_window", 2.0))
+FLOOD_BURST = int(config.get("flood_burst", 2))
+BALLOT_MODE = config.get("ballot_mode", "single")  # single: 1인 1표 / approval: 여러 개 찬성 + 마감 전 변경
+CHAT_DEDUP_TTL = float(config.get("chat_dedup_ttl", 300))
+CHAT_DEDUP_SIZE = int(config.get("chat_dedup_size", 20000))
+FANOUT_PORT = config.get("fanout_port")  # 설정 시 로컬 이벤트 허브 사용 (0이면 임의 포트)
+FANOUT_HOST = config.get("fanout_host", "127.0.0.1")
+FANOUT_BUFFER = int(config.get("fanout_buffer", 1000))
+FANOUT_OVERFLOW = config.get("fanout_overflow", "drop_oldest")  # drop_oldest | disconnect
 
 # ======== CHZZK Open API 엔드포인트 ========
 OPENAPI_BASE = "https://openapi.chzzk.naver.com"
+SOCKET_TRANSPORTS = ["websocket"]
+
+# -------------------------
+# 시계: 라운드 루프/집계/대기는 모두 CLOCK으로 시간을 본다
+# (운영: 실시간, 소크: 배속 실시간, 시뮬레이션: 가상 시간)
+# -------------------------
+class WallClock:
+    """실제 시계. scale > 1 이면 봇 시간이 scale 배로 흐른다 (소크 테스트)"""
+    def __init__(self, scale=1.0):
+        self.scale = float(scale)
+        self._t0 = time.time()
+
+    def now(self):
+        if self.scale == 1.0:
+            return time.time()
+        return self._t0 + (time.time() - self._t0) * self.scale
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds / self.scale)
+
+    def wait(self, event, seconds):
+        """threading.Event를 봇 시간 seconds 동안 기다림"""
+        return event.wait(seconds / self.scale)
+
+    def sleep_until(self, deadline, on_tick=None, tick=1.0):
+        """deadline(봇 시각)까지 최대 tick초 단위로 자면서 on_tick 호출"""
+        while True:
+            remaining = deadline - self.now()
+            if remaining <= 0:
+                return
+            self.sleep(min(remaining, tick))
+            if on_tick:
+                on_tick()
+
+class VirtualClock:
+    """
+    가상 시계 (시뮬레이션). sleep은 시각만 옮기고, 그 사이 call_at으로 예약된 콜백을
+    시간 순서대로 실행한다. 모든 진행이 호출한 스레드 하나에서 일어난다.
+    """
+    def __init__(self, start=0.0):
+        self._now = float(start)
+        self._events = []  # (시각, 순번, 콜백) 힙
+        self._seq = 0
+
+    def now(self):
+        return self._now
+
+    def call_at(self, when, fn):
+        heapq.heappush(self._events, (when, self._seq, fn))
+        self._seq += 1
+
+    def _advance(self, target):
+        events = self._events
+        while events and events[0][0] <= target:
+            when, _, fn = heapq.heappop(events)
+            self._now = max(self._now, when)
+            fn()
+        self._now = max(self._now, target)
+
+    def sleep(self, seconds):
+        self._advance(self._now + max(0.0, seconds))
+
+    def wait(self, event, seconds):
+        deadline = self._now + seconds
+        while not event.is_set() and self._now < deadline:
+            self._advance(min(deadline, self._events[0][0] if self._events else deadline))
+        return event.is_set()
+
+    def sleep_until(self, deadline, on_tick=None, tick=1.0):
+        while self._now < deadline:
+            self._advance(min(deadline, self._now + tick))
+            if on_tick:
+                on_tick()
+
+CLOCK = WallClock()
 
 # -------------------------
 # REST 유틸 (표준 헤더 + 예외시 raise)
@@ -100,33 +422,99 @@ def _std_headers(access_token: str | None = None):
         "Referer": "https://chzzk.naver.com/",
     }
 
-def http_get(path, params=None, timeout=10):
-    url = f"{OPENAPI_BASE}{path}"
-    r = requests.get(url, headers=_std_headers(), params=params, timeout=timeout)
+def http_get(path, params=None, timeout=10, base=None, access_token=None):
+    url = f"{base or OPENAPI_BASE}{path}"
+    r = requests.get(url, headers=_std_headers(access_token), params=params, timeout=timeout)
     r.raise_for_status()
     return r.json()
 
-def http_post(path, params=None, json_body=None, timeout=10):
-    url = f"{OPENAPI_BASE}{path}"
-    r = requests.post(url, headers=_std_headers(), params=params, json=json_body, timeout=timeout)
+def http_post(path, params=None, json_body=None, timeout=10, base=None, access_token=None):
+    url = f"{base or OPENAPI_BASE}{path}"
+    r = requests.post(url, headers=_std_headers(access_token), params=params, json=json_body, timeout=timeout)
     r.raise_for_status()
     return r.json() if r.content else None
 
+# -------------------------
+# 채널/사용자 식별 (시작 시 1회 /open/v1/users/me, 토큰 옆에 만료와 함께 캐시)
+# -------------------------
+IDENTITY_FALLBACK_TTL = 24 * 60 * 60  # 토큰에 만료 정보가 없을 때 캐시 유효 시간
+
+def _token_expiry(token):
+    try:
+        return int(token["obtained_at"]) + int(token["expiresIn"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _token_fingerprint(token):
+    """accessToken의 sha256 앞 16자리 (토큰 원문은 캐시에 남기지 않음). 토큰이 없으면 None"""
+    access = token.get("accessToken") if isinstance(token, dict) else None
+    if not access:
+        return None
+    return hashlib.sha256(access.encode("utf-8")).hexdigest()[:16]
+
+def _load_identity(path, token):
+    """같은 accessToken(지문)으로 확인했고 아직 만료 전인 캐시만 사용"""
+    fingerprint = _token_fingerprint(token)
+    if fingerprint is None:
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            ident = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not ident.get("channelId") or ident.get("token_fp") != fingerprint:
+        return None
+    if time.time() >= ident.get("expires_at", 0):
+        return None
+    return ident
+
+def resolve_channel_identity(token, path=IDENTITY_FILE):
+    """토큰 주인의 채널 ID/이름. 유효한 캐시가 있으면 API를 부르지 않음 (실패 시 raise)"""
+    ident = _load_identity(path, token)
+    if ident:
+        return ident
+    access = token.get("accessToken") if isinstance(token, dict) else None
+    if not access:
+        raise RuntimeError("토큰에 accessToken이 없습니다")
+    # 전역 ACCESS_TOKEN이 아니라 이 토큰으로 조회 (캐시에 남기는 지문과 같은 토큰)
+    resp = http_get("/open/v1/users/me", access_token=access)
+    content = resp.get("content") if isinstance(resp, dict) else None
+    if not isinstance(content, dict):
+        content = resp if isinstance(resp, dict) else {}
+    if not content.get("channelId"):
+        raise RuntimeError(f"users/me 응답에 channelId가 없습니다: {resp}")
+    now = int(time.time())
+    ident = {
+        "channelId": content["channelId"],
+        "channelName": content.get("channelName"),
+        "token_fp": _token_fingerprint(token),
+        "resolved_at": now,
+        "expires_at": _token_expiry(token) or now + IDENTITY_FALLBACK_TTL,
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(ident, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return ident
+
 # -------------------------
 # 공지 전송 (공식 Chat API + 지수 백오프) - 재시도 횟수 감소
 # -------------------------
-def send_chat_notice(_channel_id_ignored: str, access_token: str, message: str):
+# 공지용 keep-alive 세션 (공지는 메인 루프에서만 보냄 → 매번 새 연결을 맺지 않음)
+_notice_session = requests.Session()
+
+def send_chat_notice(_channel_id_ignored: str, access_token: str, message: str, api_base=None):
     """
     공지 등록은 공식 Chat API를 사용합니다.
-    Endpoint: POST /open/v1/chats/notice
+    Endpoint: POST /open/v1/chats/notice (api_base 기본값 OPENAPI_BASE)
     """
     path = "/open/v1/chats/notice"
     payload = {"message": message}
-    s = requests.Session()
+    s = _notice_session
     backoff = 1
     for attempt in range(3):  # 5 → 3으로 감소
         try:
-            url = f"{OPENAPI_BASE}{path}"
+            url = f"{api_base or OPENAPI_BASE}{path}"
             logger.debug("[NOTICE] endpoint=%s", url)  # INFO → DEBUG
             r = s.post(url, headers=_std_headers(access_token), json=payload, timeout=10)
             r.raise_for_status()
@@ -137,56 +525,438 @@ def send_chat_notice(_channel_id_ignored: str, access_token: str, message: str):
             logger.warning("공지 전송 오류 (HTTP %s, 재시도 %d)", status, attempt + 1)
         except Exception:
             logger.warning("공지 전송 오류 (재시도 %d)", attempt + 1)
-        time.sleep(backoff)
+        CLOCK.sleep(backoff)
         backoff = min(backoff * 2, 8)
 
 # -------------------------
 # 투표 결과 저장 (문자열 깨짐 방지)
 # -------------------------
-def save_vote_result_lua(effect_name):
-    path = os.path.join(SAVE_DIR, "vote_result.lua")
+def _effect_ids(names):
+    """카탈로그 ID 목록 "3,7" (하나라도 ID가 없으면 None → 이름으로만 발행)"""
+    ids = [EFFECT_IDS.get(str(n)) for n in names]
+    if not ids or None in ids:
+        return None
+    return ",".join(str(i) for i in ids)
+
+def _result_record(effect_text, generation=None, published_at=None, effect_ids=None):
+    """effect_name 줄 + (선택) 카탈로그 ID/세대 ID/발행 시각(ms) 줄. main.lua는 effect_id가 있으면 우선 사용"""
+    lines = [f"effect_name={effect_text}\n"]
+    if effect_ids:
+        lines.append(f"effect_id={effect_ids}\n")
+    if generation is not None:
+        lines.append(f"generation={generation}\n")
+    if published_at is not None:
+        lines.append(f"published_at={int(published_at * 1000)}\n")
+    return "".join(lines)
+
+def save_vote_result_lua(effect_name, generation=None, published_at=None, save_dir=None):
+    path = os.path.join(save_dir or SAVE_DIR, "vote_result.lua")
     with open(path, "w", encoding="utf-8") as f:
         if effect_name is None or str(effect_name).strip().lower() == "none":
             f.write("")
             return
-        f.write(f"effect_name={effect_name}\n")
+        f.write(_result_record(effect_name, generation, published_at, _effect_ids([effect_name])))
 
-def save_vote_result_txt(effect_name):
-    path = os.path.join(SAVE_DIR, "vote_result.txt")
+def save_vote_result_txt(effect_name, generation=None, published_at=None, save_dir=None):
+    path = os.path.join(save_dir or SAVE_DIR, "vote_result.txt")
     with open(path, "w", encoding="utf-8") as f:
         if effect_name is None or str(effect_name).strip().lower() == "none":
             f.write("")
             return
-        f.write(f"effect_name={effect_name}\n")
+        f.write(_result_record(effect_name, generation, published_at, _effect_ids([effect_name])))
 
-def save_vote_result_multi_lua(effect_names):
+def save_vote_result_multi_lua(effect_names, generation=None, published_at=None, save_dir=None):
     """동표 결과만 저장 (0표는 제외, main.lua 호환)"""
     if not isinstance(effect_names, (list, tuple)) or len(effect_names) < 2:
         return
-    path = os.path.join(SAVE_DIR, "vote_result.lua")
+    path = os.path.join(save_dir or SAVE_DIR, "vote_result.lua")
     with open(path, "w", encoding="utf-8") as f:
         joined = ", ".join(str(n) for n in effect_names)
-        f.write(f"effect_name={joined}\n")
+        f.write(_result_record(joined, generation, published_at, _effect_ids(effect_names)))
 
-def save_vote_result_multi_txt(effect_names):
+def save_vote_result_multi_txt(effect_names, generation=None, published_at=None, save_dir=None):
     """동표 결과만 저장 (0표는 제외, main.lua 호환)"""
     if not isinstance(effect_names, (list, tuple)) or len(effect_names) < 2:
         return
-    path = os.path.join(SAVE_DIR, "vote_result.txt")
+    path = os.path.join(save_dir or SAVE_DIR, "vote_result.txt")
     with open(path, "w", encoding="utf-8") as f:
         joined = ", ".join(str(n) for n in effect_names)
-        f.write(f"effect_name={joined}\n")
-        
+        f.write(_result_record(joined, generation, published_at, _effect_ids(effect_names)))
+
+def publish_vote_result(winner, winners, generation, published_at, save_dir=None):
+    """라운드 결과를 lua → txt 순서로 기록 (save_dir 기본값 SAVE_DIR). 발행된 효과 이름 목록 반환 (무투표면 빈 목록)"""
+    if winners and len(winners) > 1:
+        save_vote_result_multi_lua(winners, generation, published_at, save_dir)
+        save_vote_result_multi_txt(winners, generation, published_at, save_dir)
+        return list(winners)
+    save_vote_result_lua(winner, generation, published_at, save_dir)
+    save_vote_result_txt(winner, generation, published_at, save_dir)
+    return [winner] if winner is not None else []
+
+# -------------------------
+# 효과 적용 확인(ACK) 채널: main.lua → vote_ack.txt
+# -------------------------
+class LatencyHistogram:
+    """투표 마감 → 효과 시작 지연 히스토그램 (초 단위 버킷)"""
+    BOUNDS = (0.5, 1, 2, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        seconds = max(0.0, float(seconds))
+        for i, bound in enumerate(self.BOUNDS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def summary(self):
+        if not self.count:
+            return "샘플 없음"
+        labels = [f"≤{b}s" for b in self.BOUNDS] + [f">{self.BOUNDS[-1]}s"]
+        dist = " ".join(f"{lab}:{n}" for lab, n in zip(labels, self.buckets) if n)
+        return "n=%d 평균=%.2fs 최대=%.2fs | %s" % (self.count, self.total / self.count, self.max, dist)
+
+class EffectAckTracker:
+    """
+    결과 파일에 넣은 generation 별로 main.lua의 ACK 줄을 모아 지연/미소비를 집계.
+    ACK 형식: generation=..;frame=..;time=..;status=started|unknown|cooldown;effect=..
+    (Lua os.time()은 초 단위라 지연값도 1초 해상도)
+    """
+    def __init__(self, path, timeout, on_ack=None, clock=None):
+        self.path = path
+        self.timeout = timeout
+        self.clock = clock or CLOCK
+        self.on_ack = on_ack  # (generation, status, effect, frame, acked_at) 콜백
+        self.pending = {}  # generation -> {"closed_at", "published_at", "names", "acks"}
+        self.histogram = LatencyHistogram()
+        self.rejected = {"unknown": 0, "cooldown": 0}
+        self.unconsumed = 0
+        self._offset = 0
+
+    def reset(self):
+        """이전 실행의 ACK 기록 비우기 (시작 시 1회)"""
+        try:
+            with open(self.path, "w", encoding="utf-8"):
+                pass
+        except OSError:
+            logger.warning("[ACK] ACK 파일 초기화 실패: %s", self.path)
+        self._offset = 0
+
+    def register(self, generation, names, closed_at, published_at):
+        self.pending[generation] = {
+            "closed_at": closed_at,
+            "published_at": published_at,
+            "names": list(names),
+            "acks": [],
+        }
+
+    def poll(self):
+        """새로 추가된 ACK 줄만 읽어 반영 (완성된 줄 단위)"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size < self._offset:
+            self._offset = 0  # 외부에서 비워짐
+        if size == self._offset:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        end = chunk.rfind(b"\n")
+        if end < 0:
+            return
+        self._offset += end + 1
+        for raw in chunk[: end + 1].decode("utf-8", "replace").splitlines():
+            self._handle_ack(raw)
+
+    def _handle_ack(self, line):
+        fields = dict(part.split("=", 1) for part in line.strip().split(";") if "=" in part)
+        gen = fields.get("generation")
+        entry = self.pending.get(gen)
+        if entry is None:
+            logger.debug("[ACK] 알 수 없는 세대 무시: %s", line)
+            return
+        status = fields.get("status", "")
+        try:
+            acked_at = float(fields.get("time", 0))
+        except ValueError:
+            acked_at = 0.0
+        entry["acks"].append((status, fields.get("effect"), fields.get("frame"), acked_at))
+        if self.on_ack:
+            self.on_ack(gen, status, fields.get("effect"), fields.get("frame"), acked_at)
+        if status == "started":
+            latency = acked_at - entry["closed_at"]
+            self.histogram.observe(latency)
+            logger.info("[ACK] gen=%s 효과 시작: %s (frame=%s, 마감→시작 %.1fs)",
+                        gen, fields.get("effect"), fields.get("frame"), max(0.0, latency))
+        elif status in self.rejected:
+            self.rejected[status] += 1
+            logger.warning("[ACK] gen=%s 효과 거부(%s): %s", gen, status, fields.get("effect"))
+
+    def check_overdue(self, now=None):
+        """timeout 안에 ACK가 하나도 없는 결과를 미소비로 표시"""
+        now = self.clock.now() if now is None else now
+        for gen, entry in list(self.pending.items()):
+            if entry["acks"]:
+                self.pending.pop(gen)
+            elif now - entry["published_at"] > self.timeout:
+                self.pending.pop(gen)
+                self.unconsumed += 1
+                logger.warning("[ACK] gen=%s 결과가 소비되지 않음: %s (%.0fs 경과)",
+                               gen, ", ".join(entry["names"]), now - entry["published_at"])
+
+    def summary(self):
+        return "지연 %s | 거부 unknown=%d cooldown=%d | 미소비 %d" % (
+            self.histogram.summary(), self.rejected["unknown"], self.rejected["cooldown"], self.unconsumed)
+
+# -------------------------
+# 라운드 기록 저장소 (SQLite WAL + 배치 쓰기)
+# -------------------------
+def _timeline_percentile(timeline, q):
+    """초 단위 득표 분포에서 q 분위(0~1)에 해당하는 경과 초"""
+    total = sum(timeline)
+    if not total:
+        return None
+    target = q * total
+    acc = 0
+    for sec, n in enumerate(timeline):
+        acc += n
+        if acc >= target:
+            return float(sec)
+    return float(len(timeline) - 1)
+
+class RoundHistoryStore:
+    """
+    라운드별 선택지/득표/승자/동표/참여자/득표 시각 분포/적용된 효과를 SQLite(WAL)에 기록.
+    쓰기는 큐에 모았다가 writer 스레드가 한 트랜잭션으로 배치 반영하고,
+    effect_rollup 테이블은 같은 트랜잭션에서 누적 집계를 갱신한다.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rounds (
+            generation   TEXT PRIMARY KEY,
+            started_at   REAL NOT NULL,
+            closed_at    REAL NOT NULL,
+            winner       TEXT,
+            tie          INTEGER NOT NULL DEFAULT 0,
+            winners      TEXT,
+            participants INTEGER NOT NULL DEFAULT 0,
+            total_votes  INTEGER NOT NULL DEFAULT 0,
+            timeline     TEXT,
+            vote_p50     REAL,
+            vote_p90     REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_rounds_closed ON rounds(closed_at);
+
+        CREATE TABLE IF NOT EXISTS round_options (
+            generation TEXT NOT NULL,
+            position   INTEGER NOT NULL,
+            effect     TEXT NOT NULL,
+            votes      INTEGER NOT NULL,
+            is_winner  INTEGER NOT NULL,
+            closed_at  REAL NOT NULL,
+            PRIMARY KEY (generation, position)
+        );
+        CREATE INDEX IF NOT EXISTS idx_options_effect ON round_options(effect, closed_at);
+
+        CREATE TABLE IF NOT EXISTS applied_effects (
+            generation TEXT NOT NULL,
+            effect     TEXT NOT NULL,
+            status     TEXT NOT NULL,
+            frame      INTEGER,
+            acked_at   REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_applied_effect ON applied_effects(effect, acked_at);
+        CREATE INDEX IF NOT EXISTS idx_applied_generation ON applied_effects(generation);
+
+        CREATE TABLE IF NOT EXISTS effect_rollup (
+            effect          TEXT PRIMARY KEY,
+            offered         INTEGER NOT NULL DEFAULT 0,
+            wins            INTEGER NOT NULL DEFAULT 0,
+            votes           INTEGER NOT NULL DEFAULT 0,
+            applied         INTEGER NOT NULL DEFAULT 0,
+            last_offered_at REAL
+        );
+    """
+
+    def __init__(self, path, batch_size=64, flush_interval=2.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._q = queue.Queue()
+        self._reader = None
+        conn = self._connect()
+        conn.executescript(self.SCHEMA)
+        conn.close()
+        self._thread = threading.Thread(target=self._writer, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # ---- 쓰기 (호출 스레드는 큐 적재만) ----
+    def record_round(self, generation, started_at, closed_at, options, votes, winners,
+                     participants, timeline):
+        self._q.put(("round", (generation, started_at, closed_at, list(options), dict(votes),
+                               list(winners), participants, list(timeline))))
+
+    def record_effect(self, generation, status, effect, frame, acked_at):
+        self._q.put(("effect", (generation, status, effect, frame, acked_at)))
+
+    def flush(self, timeout=10):
+        done = threading.Event()
+        self._q.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self):
+        self.flush()
+        self._q.put(("stop", None))
+        self._thread.join(timeout=10)
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def _writer(self):
+        conn = self._connect()
+        while True:
+            batch = [self._q.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1][0] not in ("flush", "stop"):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    for kind, item in batch:
+                        if kind == "round":
+                            self._insert_round(conn, *item)
+                        elif kind == "effect":
+                            self._insert_effect(conn, *item)
+            except Exception:
+                logger.exception("[HISTORY] 기록 저장 실패 (%d건)", len(batch))
+            for kind, item in batch:
+                if kind == "flush":
+                    item.set()
+                elif kind == "stop":
+                    conn.close()
+                    return
+
+    @staticmethod
+    def _insert_round(conn, generation, started_at, closed_at, options, votes, winners,
+                      participants, timeline):
+        total = sum(int(v) for v in votes.values())
+        winner = winners[0] if winners else None
+        conn.execute(
+            "INSERT OR REPLACE INTO rounds VALUES (?,?,?,?,?,?,?,?,?,?,?)",
+            (generation, started_at, closed_at, winner, int(len(winners) > 1),
+             json.dumps(winners, ensure_ascii=False), participants, total,
+             json.dumps(timeline), _timeline_percentile(timeline, 0.5), _timeline_percentile(timeline, 0.9)),
+        )
+        rows = [(generation, pos, opt, int(votes.get(opt, 0)), int(opt in winners), closed_at)
+                for pos, opt in enumerate(options, start=1)]
+        conn.executemany("INSERT OR REPLACE INTO round_options VALUES (?,?,?,?,?,?)", rows)
+        conn.executemany(
+            "INSERT INTO effect_rollup (effect, offered, wins, votes, last_offered_at) VALUES (?,1,?,?,?) "
+            "ON CONFLICT(effect) DO UPDATE SET offered = offered + 1, wins = wins + excluded.wins, "
+            "votes = votes + excluded.votes, last_offered_at = excluded.last_offered_at",
+            [(eff, is_win, n, at) for _, _, eff, n, is_win, at in rows],
+        )
+
+    @staticmethod
+    def _insert_effect(conn, generation, status, effect, frame, acked_at):
+        try:
+            frame = int(frame) if frame is not None else None
+        except ValueError:
+            frame = None
+        conn.execute("INSERT INTO applied_effects VALUES (?,?,?,?,?)",
+                     (generation, effect, status, frame, acked_at))
+        if status == "started":
+            conn.execute(
+                "INSERT INTO effect_rollup (effect, applied) VALUES (?,1) "
+                "ON CONFLICT(effect) DO UPDATE SET applied = applied + 1",
+                (effect,),
+            )
+
+    # ---- 읽기 (메인 스레드 전용 연결) ----
+    def _read_conn(self):
+        if self._reader is None:
+            self._reader = sqlite3.connect(self.path, timeout=10)
+        return self._reader
+
+    def win_rates(self, last_n=500):
+        """최근 last_n 라운드 기준 효과별 {"offered", "wins", "votes", "win_rate"}"""
+        rows = self._read_conn().execute(
+            "SELECT o.effect, COUNT(*), SUM(o.is_winner), SUM(o.votes) FROM round_options o "
+            "JOIN (SELECT generation FROM rounds ORDER BY closed_at DESC LIMIT ?) r "
+            "ON r.generation = o.generation GROUP BY o.effect",
+            (int(last_n),),
+        ).fetchall()
+        return {
+            eff: {"offered": n, "wins": w, "votes": v, "win_rate": (w / n) if n else 0.0}
+            for eff, n, w, v in rows
+        }
+
+    def rollup(self):
+        """전체 기간 누적 집계 (effect_rollup 그대로)"""
+        rows = self._read_conn().execute(
+            "SELECT effect, offered, wins, votes, applied, last_offered_at FROM effect_rollup"
+        ).fetchall()
+        return {r[0]: {"offered": r[1], "wins": r[2], "votes": r[3], "applied": r[4],
+                       "last_offered_at": r[5]} for r in rows}
+
+    def suggest_weights(self, effects, base_weights, last_n=500, count=3, default=10):
+        """
+        pick_effects_with_weight에 그대로 넣을 수 있는 가중치.
+        최근 승률을 기대 승률(1/count)과 비교해 기본 가중치를 0.5~2배로 조정 (표본이 적으면 1배 근처)
+        """
+        stats = self.win_rates(last_n)
+        prior = 1.0 / count
+        smoothing = count  # 가상 표본 수
+        weights = {}
+        for eff in effects:
+            base = base_weights.get(eff, default)
+            if base <= 0:
+                weights[eff] = base
+                continue
+            st = stats.get(eff)
+            if not st:
+                weights[eff] = base
+                continue
+            rate = (st["wins"] + prior * smoothing) / (st["offered"] + smoothing)
+            factor = min(2.0, max(0.5, rate / prior))
+            weights[eff] = round(base * factor, 3)
+        return weights
+
 # -------------------------
 # 세션 API (Socket.IO) 사용
 # -------------------------
 class ChzzkSessionListener:
-    def __init__(self, access_token, on_chat_callback=None):
+    def __init__(self, access_token, on_chat_callback=None, on_event=None, api_base=None, transports=None):
         self.access_token = access_token
+        self.api_base = api_base  # None이면 OPENAPI_BASE
+        self.transports = transports or SOCKET_TRANSPORTS
         self.running = True
         self.sio = socketio.Client(reconnection=False, logger=False, engineio_logger=False)
         self.session_key = None
         self.channel_id = None
+        self.subscribed = threading.Event()  # CHAT 구독 확인(SYSTEM subscribed) 시 set
+        self.on_event = on_event  # (type, dict) - CHAT/DONATION/SUBSCRIPTION/GAP 재배포용 (막히면 안 됨)
         self._bind_handlers(on_chat_callback)
 
     def stop(self):
@@ -229,7 +999,8 @@ class ChzzkSessionListener:
                         logger.error("[SYSTEM] sessionKey 없음 - 구독 불가")
                         return
                     try:
-                        http_post("/open/v1/sessions/events/subscribe/chat", params={"sessionKey": self.session_key})
+                        http_post("/open/v1/sessions/events/subscribe/chat", params={"sessionKey": self.session_key},
+                                  base=self.api_base)
                         logger.info("[SYSTEM] 채팅 이벤트 구독 완료")
                     except Exception:
                         logger.exception("[SYSTEM] 채팅 이벤트 구독 실패")
@@ -238,7 +1009,11 @@ class ChzzkSessionListener:
                     di = (d.get("data") or {})
                     if di.get("eventType") == "CHAT":
                         self.channel_id = di.get("channelId")
+                        self.subscribed.set()
                         logger.info("[SYSTEM] 구독 채널 ID: %s", self.channel_id)
+                        if CHANNEL_ID and self.channel_id and self.channel_id != CHANNEL_ID:
+                            logger.warning("[SYSTEM] 구독 채널(%s)이 시작 시 확인한 채널(%s)과 다릅니다",
+                                           self.channel_id, CHANNEL_ID)
 
             except Exception:
                 logger.exception("[SYSTEM] 처리 중 오류")
@@ -249,16 +1024,22 @@ class ChzzkSessionListener:
                 d = ChzzkSessionListener._asdict(data)
                 if on_chat_callback:
                     on_chat_callback(d)
+                if self.on_event:
+                    self.on_event("CHAT", d)
             except Exception:
                 logger.exception("[CHAT] 처리 중 오류")
 
         @self.sio.on("DONATION")
         def on_donation(data):
             logger.debug("[DONATION] %s", data)  # INFO → DEBUG
+            if self.on_event:
+                self.on_event("DONATION", ChzzkSessionListener._asdict(data))
 
         @self.sio.on("SUBSCRIPTION")
         def on_subscription(data):
             logger.debug("[SUBSCRIPTION] %s", data)  # INFO → DEBUG
+            if self.on_event:
+                self.on_event("SUBSCRIPTION", ChzzkSessionListener._asdict(data))
 
         @self.sio.event
         def connect_error(e):
@@ -266,7 +1047,7 @@ class ChzzkSessionListener:
 
     def create_session_url(self):
         try:
-            resp = http_get("/open/v1/sessions/auth")
+            resp = http_get("/open/v1/sessions/auth", base=self.api_base)
             content = resp.get("content") if isinstance(resp, dict) else None
             session_url = None
             if isinstance(content, dict):
@@ -289,7 +1070,7 @@ class ChzzkSessionListener:
                 logger.info("[SOCKET] 연결 시도: %s", url)
                 self.sio.connect(
                     url,
-                    transports=["websocket"],
+                    transports=self.transports,
                     wait_timeout=5,
                     headers=headers or {
                         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)",
@@ -297,10 +1078,16 @@ class ChzzkSessionListener:
                         "Referer": "https://chzzk.naver.com/",
                     },
                 )
-                self.sio.wait()
+                # sio.wait()는 끊긴 뒤 재연결 태스크용으로 1초를 더 자므로 연결 상태를 직접 확인
+                # (stop()이 연결 도중 호출돼도 여기서 빠져나가 finally에서 정리됨)
+                while self.running and self.sio.connected:
+                    CLOCK.sleep(0.1)
+                if self.running and self.on_event:
+                    # 세션이 끊겨 다시 연결함: 그 사이 이벤트가 빠졌을 수 있음을 재배포 구독자에게 알림
+                    self.on_event("GAP", {"reason": "reconnect"})
             except Exception:
                 logger.exception("[SOCKET] 예외 발생 - 재시도 예정")
-                time.sleep(backoff)
+                CLOCK.sleep(backoff)
                 backoff = min(backoff * 2, 30)
             finally:
                 try:
@@ -313,12 +1100,17 @@ class ChzzkSessionListener:
 # ✅ 투표 로직 (Thread-Safe 개선)
 # -------------------------
 class VoteManager:
-    def __init__(self, options):
+    approval = False  # 채팅 핸들러가 명령 해석 방식을 고를 때 사용
+
+    def __init__(self, options, voting=True, clock=None):
         self.options = options
         self.votes = {opt: 0 for opt in options}
         self.user_voted_ids = set()
-        self.voting = True
+        self.voting = voting
         self.lock = threading.Lock()  # 🔒 동시성 제어 추가
+        self.clock = clock or CLOCK
+        self.started_at = self.clock.now()
+        self.vote_timeline = []  # 투표 시작 후 경과 초별 성공 투표 수
         
         # 📊 성능 모니터링용
         self.total_attempts = 0
@@ -332,6 +1124,10 @@ class VoteManager:
                 self.votes[vote] += 1
                 self.user_voted_ids.add(user_id)
                 self.successful_votes += 1
+                sec = int(self.clock.now() - self.started_at)
+                if sec >= len(self.vote_timeline):
+                    self.vote_timeline.extend([0] * (sec + 1 - len(self.vote_timeline)))
+                self.vote_timeline[sec] += 1
                 return True
             return False
 
@@ -366,6 +1162,398 @@ class VoteManager:
         with self.lock:
             return dict(self.votes)
 
+    def open_vote(self):
+        """미리 만들어 둔(닫힌) 매니저를 시작 공지 시점에 연다"""
+        with self.lock:
+            self.started_at = self.clock.now()
+            self.voting = True
+
+    def get_participation(self):
+        """(참여자 수, 경과 초별 득표 분포)"""
+        with self.lock:
+            return len(self.user_voted_ids), list(self.vote_timeline)
+
+    def has_voted(self, user_id):
+        """락 없이 보는 사전 확인 (set 멤버십은 원자적). 최종 판정은 chat_vote가 함"""
+        return user_id in self.user_voted_ids
+
+class ApprovalVoteManager(VoteManager):
+    """
+    찬성 투표: 한 사람이 여러 선택지를 고를 수 있고, 마감 전까지 다시 보내면 표를 바꾼다.
+    사용자별 선택은 array('B') 한 칸(비트마스크), 사용자 → 칸 번호만 dict로 둔다 (사용자당 set 없음).
+    득표는 바뀐 비트만 더하고 빼므로 변경이 O(선택지 수), 현황 조회는 집계를 그대로 복사.
+    승자/동표 판정은 VoteManager와 같아서 save_vote_result_multi_* 로 그대로 이어진다.
+    """
+    approval = True
+    MAX_OPTIONS = 8  # 마스크 1바이트
+
+    def __init__(self, options, voting=True, clock=None):
+        if len(options) > self.MAX_OPTIONS:
+            raise ValueError(f"찬성 투표 선택지는 최대 {self.MAX_OPTIONS}개입니다: {len(options)}")
+        # votes/user_voted_ids 대신 아래 배열로 관리하므로 부모 __init__은 쓰지 않음
+        self.options = options
+        self.voting = voting
+        self.lock = threading.Lock()
+        self.clock = clock or CLOCK
+        self.started_at = self.clock.now()
+        self.vote_timeline = []
+        self.total_attempts = 0
+        self.successful_votes = 0
+        n = len(options)
+        self._index = {opt: i for i, opt in enumerate(options)}
+        self._bits = [tuple(i for i in range(n) if m >> i & 1) for m in range(1 << n)]
+        self._tally = [0] * n
+        self._slot = {}  # user_id -> _masks 칸 번호
+        self._masks = array("B")
+
+    @property
+    def votes(self):
+        return dict(zip(self.options, self._tally))
+
+    def chat_ballot(self, user_id, picks):
+        """picks(선택지 목록)로 이 사용자의 표를 통째로 교체. 바뀌었으면 True"""
+        mask = 0
+        for opt in picks:
+            i = self._index.get(opt)
+            if i is not None:
+                mask |= 1 << i
+        with self.lock:
+            self.total_attempts += 1
+            if not (self.voting and mask):
+                return False
+            slot = self._slot.get(user_id)
+            if slot is None:
+                slot = self._slot[user_id] = len(self._masks)
+                self._masks.append(0)
+            old = self._masks[slot]
+            if old == mask:
+                return False
+            tally = self._tally
+            for i in self._bits[old & ~mask]:
+                tally[i] -= 1
+            for i in self._bits[mask & ~old]:
+                tally[i] += 1
+            self._masks[slot] = mask
+            self.successful_votes += 1
+            sec = int(self.clock.now() - self.started_at)
+            if sec >= len(self.vote_timeline):
+                self.vote_timeline.extend([0] * (sec + 1 - len(self.vote_timeline)))
+            self.vote_timeline[sec] += 1
+            return True
+
+    def chat_vote(self, user_id, vote):
+        return self.chat_ballot(user_id, [vote])
+
+    def get_current_votes(self):
+        with self.lock:
+            return dict(zip(self.options, self._tally))
+
+    def get_participation(self):
+        with self.lock:
+            return len(self._slot), list(self.vote_timeline)
+
+    def has_voted(self, user_id):
+        """표 변경이 허용되므로 사전 차단하지 않음 (반복 전송은 도배 차단이 제한)"""
+        return False
+
+def parse_ballot(cmd, options):
+    """'!투표' 뒤 문자열 → 선택지 목록. "1 3", "1,3", "1+3" 또는 선택지 이름 하나"""
+    if cmd in options:
+        return [cmd]
+    picks = []
+    for tok in re.split(r"[\s,+]+", cmd):
+        if tok.isdigit() and 1 <= int(tok) <= len(options):
+            opt = options[int(tok) - 1]
+            if opt not in picks:
+                picks.append(opt)
+    return picks
+
+def new_vote_manager(options, voting=True, clock=None):
+    """config ballot_mode에 맞는 투표 매니저"""
+    if BALLOT_MODE == "approval":
+        return ApprovalVoteManager(options, voting, clock)
+    return VoteManager(options, voting, clock)
+
+# -------------------------
+# 사용자별 도배 차단 (집계 앞단, 타임휠 만료)
+# -------------------------
+class VoterFloodGate:
+    """
+    사용자별로 window 초 안에 burst 개의 투표 명령만 통과시킨다.
+    사용자당 dict 항목 1개 + 휠 슬롯 리스트 항목 1개(O(1)), 처음 본 시점의 슬롯이
+    한 바퀴 돌아오면 통째로 비우므로 메모리는 window 동안의 활성 사용자 수로 제한된다.
+    engineio 클라이언트가 메시지마다 별도 스레드에서 콜백을 부르므로 락을 쓴다
+    (휠 슬롯을 비우는 사이 다른 스레드가 그 슬롯에 키를 넣으면 그 키는 영영 만료되지 않음).
+    """
+    def __init__(self, window=2.0, burst=2, slots=32, clock=None):
+        self.clock = clock or CLOCK
+        self.burst = max(1, int(burst))
+        self.slots = max(2, int(slots))
+        self.tick = max(0.01, float(window)) / self.slots
+        self._wheel = [[] for _ in range(self.slots)]
+        self._hits = {}  # user -> window 안의 명령 수
+        self._cursor = None  # 첫 호출 시각의 슬롯 번호
+        self._lock = threading.Lock()
+        self.dropped = 0         # 도배(버스트 초과)로 버린 수
+        self.repeat_dropped = 0  # 이미 투표한 사용자라 버린 수
+
+    def _advance(self, cur):
+        steps = min(cur - self._cursor, self.slots)
+        for i in range(1, steps + 1):
+            slot = (self._cursor + i) % self.slots
+            bucket = self._wheel[slot]
+            if bucket:
+                for key in bucket:
+                    self._hits.pop(key, None)
+                self._wheel[slot] = []
+        self._cursor = cur
+
+    def allow(self, key, now=None):
+        cur = int((self.clock.now() if now is None else now) / self.tick)
+        with self._lock:
+            if self._cursor is None:
+                self._cursor = cur
+            elif cur > self._cursor:
+                self._advance(cur)
+            else:
+                cur = self._cursor
+            n = self._hits.get(key)
+            if n is None:
+                self._hits[key] = 1
+                self._wheel[cur % self.slots].append(key)
+                return True
+            if n < self.burst:
+                self._hits[key] = n + 1
+                return True
+            self.dropped += 1
+            return False
+
+    def count_repeat(self):
+        """이미 투표한 사용자의 명령을 버렸을 때 (집계 전 단계에서 호출)"""
+        with self._lock:
+            self.repeat_dropped += 1
+
+    @property
+    def active_users(self):
+        return len(self._hits)
+
+    def stats(self):
+        return "도배 차단 %d, 재투표 차단 %d, 추적 중 사용자 %d" % (
+            self.dropped, self.repeat_dropped, self.active_users)
+
+# -------------------------
+# 채팅 중복 수신 제거 (재연결/재전송으로 같은 메시지가 두 번 와도 한 번만 집계, 라운드 간 공유)
+# -------------------------
+def chat_message_key(u, sender_key):
+    """메시지 ID가 있으면 그대로, 없으면 (보낸 사람, messageTime, 내용) 해시. 시각도 없으면 None(판단 안 함)"""
+    mid = u.get("messageId") or u.get("msgId") or u.get("chatId")
+    if mid:
+        return str(mid)
+    sent_at = u.get("messageTime") or u.get("msgTime")
+    if sent_at is None:
+        return None
+    return hash((sender_key, sent_at, u.get("content", "")))
+
+class ChatDedupCache:
+    """
+    최근 ttl 초 동안 본 메시지 키를 최대 capacity 개까지 기억한다.
+    넣은 순서 = 만료 순서이므로 OrderedDict 앞에서부터 만료분을 걷어내고, 용량을 넘으면 가장 오래된 것부터 버린다.
+    재연결이 겹치면 리스너 두 개가 동시에 호출할 수 있어 락을 쓴다.
+    """
+    def __init__(self, ttl=300.0, capacity=20000, clock=None):
+        self.ttl = float(ttl)
+        self.capacity = max(1, int(capacity))
+        self.clock = clock or CLOCK
+        self._seen = OrderedDict()  # key -> 만료 시각(clock)
+        self._lock = threading.Lock()
+        self.hits = 0     # 중복으로 버린 수
+        self.expired = 0  # ttl 지나 걷어낸 수
+        self.evicted = 0  # 용량 초과로 밀려난 수 (ttl 안인데 잊음 → capacity 부족 신호)
+
+    def first_seen(self, key, now=None):
+        """처음 보는 키면 기록하고 True, ttl 안에 본 적 있으면 False"""
+        if key is None:
+            return True
+        now = self.clock.now() if now is None else now
+        with self._lock:
+            seen = self._seen
+            while seen:
+                oldest, expires = next(iter(seen.items()))
+                if expires > now:
+                    break
+                del seen[oldest]
+                self.expired += 1
+            if key in seen:
+                self.hits += 1
+                return False
+            seen[key] = now + self.ttl
+            if len(seen) > self.capacity:
+                seen.popitem(last=False)
+                self.evicted += 1
+        return True
+
+    def stats(self):
+        return "중복 차단 %d, 만료 %d, 용량 초과 제거 %d, 보관 %d" % (
+            self.hits, self.expired, self.evicted, len(self._seen))
+
+# -------------------------
+# 로컬 이벤트 팬아웃 허브 (오버레이/관리봇/분석 도구가 봇의 Chzzk 연결 하나를 공유)
+# -------------------------
+FANOUT_SEND_TIMEOUT = 10  # 구독자 소켓 전송이 이만큼 막히면 끊음
+
+class _FanoutSubscriber:
+    """구독자 1명: 유한 버퍼 + 전용 전송 스레드 (느린 소켓은 이 스레드만 막힘)"""
+    def __init__(self, hub, sock, addr):
+        self.hub = hub
+        self.sock = sock
+        self.addr = addr
+        self.buf = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.lagged = 0   # 버린 뒤 아직 알리지 않은 이벤트 수
+        self.dropped = 0
+        self.sent = 0
+        self.thread = threading.Thread(target=self._send_loop, daemon=True)
+
+    def offer(self, line):
+        """버퍼에 넣기만 한다. disconnect 정책에서 버퍼가 가득 차면 False"""
+        with self.cond:
+            if self.closed:
+                return True
+            if len(self.buf) >= self.hub.max_buffer:
+                if self.hub.overflow == "disconnect":
+                    return False
+                self.buf.popleft()
+                self.lagged += 1
+                self.dropped += 1
+            self.buf.append(line)
+            self.cond.notify()
+        return True
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def _send_loop(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.buf and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    batch = list(self.buf)
+                    self.buf.clear()
+                    lagged, self.lagged = self.lagged, 0
+                if lagged:
+                    # 버려진 구간이 있었음을 구독자가 알 수 있도록 (버린 이벤트들 자리에)
+                    batch.insert(0, json.dumps({"type": "LAG", "dropped": lagged}).encode("utf-8") + b"\n")
+                self.sock.sendall(b"".join(batch))
+                self.sent += len(batch)
+        except OSError:
+            pass
+        finally:
+            self.hub._remove(self)
+
+class EventFanoutHub:
+    """
+    host:port 로 접속한 구독자에게 CHAT/DONATION/SUBSCRIPTION 을 JSON 한 줄씩 전달
+    ({"type": ..., "ts": ..., "data": {...}}).
+    publish()는 채팅 수신 스레드에서 호출되므로 절대 막히지 않는다. 구독자 버퍼(max_buffer)가 차면
+      drop_oldest: 오래된 이벤트를 버리고 다음 전송 앞에 {"type": "LAG", "dropped": n} 을 붙임
+      disconnect : 해당 구독자 연결을 끊음
+    봇의 Chzzk 세션은 라운드마다 새로 연결하므로(대기 단계에 다음 라운드 세션 구독), 세션이 바뀌거나
+    재연결될 때 {"type": "GAP", "data": {"reason": "session_switch" | "reconnect", ...}} 을 발행한다.
+    GAP 이후 다음 이벤트까지 들어온 후원/구독 등은 빠졌을 수 있다.
+    """
+    def __init__(self, host="127.0.0.1", port=0, max_buffer=1000, overflow="drop_oldest"):
+        if overflow not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"알 수 없는 fanout_overflow: {overflow}")
+        self.host = host
+        self.port = port
+        self.max_buffer = max(1, int(max_buffer))
+        self.overflow = overflow
+        self._subs = []  # 교체식 리스트: publish는 락 없이 순회
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._running = False
+        self.published = 0
+        self.disconnected = 0
+
+    def start(self):
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        srv.bind((self.host, self.port))
+        srv.listen(16)
+        srv.settimeout(0.5)
+        self.port = srv.getsockname()[1]
+        self._server = srv
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+        if self._server:
+            self._server.close()
+        subs = self._subs
+        for sub in subs:
+            self._remove(sub)
+        for sub in subs:
+            sub.thread.join(timeout=2)
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                sock, addr = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            sock.settimeout(FANOUT_SEND_TIMEOUT)
+            sub = _FanoutSubscriber(self, sock, addr)
+            with self._lock:
+                self._subs = self._subs + [sub]
+            sub.thread.start()
+            logger.info("[FANOUT] 구독자 연결: %s:%d (총 %d)", addr[0], addr[1], len(self._subs))
+
+    def _remove(self, sub):
+        with self._lock:
+            if sub not in self._subs:
+                return
+            self._subs = [s for s in self._subs if s is not sub]
+            self.disconnected += 1
+        sub.close()
+        logger.info("[FANOUT] 구독자 해제: %s:%d (전송 %d, 버림 %d)",
+                    sub.addr[0], sub.addr[1], sub.sent, sub.dropped)
+
+    def publish(self, event_type, data):
+        subs = self._subs
+        if not subs:
+            return
+        line = (json.dumps({"type": event_type, "ts": round(time.time(), 3), "data": data},
+                           ensure_ascii=False) + "\n").encode("utf-8")
+        self.published += 1
+        for sub in subs:
+            if not sub.offer(line):
+                logger.warning("[FANOUT] 버퍼 초과로 구독자 끊음: %s:%d", sub.addr[0], sub.addr[1])
+                self._remove(sub)
+
+    def stats(self):
+        subs = self._subs
+        return "구독자 %d, 발행 %d, 버림 %d, 끊김 %d" % (
+            len(subs), self.published, sum(s.dropped for s in subs), self.disconnected)
+
 # ---- 가중치 기반 효과 3개 픽 (중복 방지) ----
 def pick_effects_with_weight(all_effects, effect_weights, count=3):
     candidates, weights = [], []
@@ -397,53 +1585,72 @@ def pick_effects_with_weight(all_effects, effect_weights, count=3):
 # -------------------------
 # 세션 리스너와 투표 매니저 연결
 # -------------------------
-def run_session_for_vote(vote_manager, vote_options):
-    def generate_chat_handler(vote_manager, vote_options):
-        def on_chat(data: dict):
-            try:
-                logger.debug("📥 [on_chat 수신됨]")  # INFO → DEBUG, 상세 로그 제거
-                u = data or {}
-                content = u.get("content", "")
-
-                profile  = u.get("profile") or {}
-                identity = u.get("identity") or {}
-                sender   = u.get("sender") or {}
-
-                voter_key = (
-                    u.get("userIdHash")
-                    or u.get("chatUserId")
-                    or u.get("messageUserId")
-                    or sender.get("userId")
-                    or profile.get("userId")
-                    or identity.get("userId")
-                    or u.get("memberChannelId")
-                    or u.get("senderChannelId")
-                    or None
-                )
+def make_chat_handler(vote_manager, vote_options, flood_gate=None, chat_dedup=None):
+    """채팅 1건 → 중복/도배/재투표 확인 후 VoteManager에 반영하는 콜백 (실제 세션/시뮬레이션 공용)"""
+    def on_chat(data: dict):
+        try:
+            logger.debug("📥 [on_chat 수신됨]")  # INFO → DEBUG, 상세 로그 제거
+            u = data or {}
+            content = u.get("content", "")
+
+            profile  = u.get("profile") or {}
+            identity = u.get("identity") or {}
+            sender   = u.get("sender") or {}
+
+            voter_key = (
+                u.get("userIdHash")
+                or u.get("chatUserId")
+                or u.get("messageUserId")
+                or sender.get("userId")
+                or profile.get("userId")
+                or identity.get("userId")
+                or u.get("memberChannelId")
+                or u.get("senderChannelId")
+                or None
+            )
 
-                if not (content and voter_key):
+            if not (content and voter_key):
+                return
+
+            voter_key = str(voter_key)
+            if not content.startswith("!투표"):
+                return
+            # 재전송된 메시지는 투표 열림 여부와 상관없이 기록 (열리기 전에 본 메시지가 열린 뒤 다시 와도 버림)
+            if chat_dedup and not chat_dedup.first_seen(chat_message_key(u, voter_key)):
+                return
+
+            if vote_manager.voting:
+                # 이미 투표했거나 도배 중이면 VoteManager 락/집계 전에 버림
+                if vote_manager.has_voted(voter_key):
+                    if flood_gate:
+                        flood_gate.count_repeat()
                     return
-
-                voter_key = str(voter_key)
-
-                if vote_manager.voting and content.startswith("!투표"):
-                    cmd = content[len("!투표"):].strip()
-                    if cmd.isdigit():
-                        idx = int(cmd) - 1
-                        if 0 <= idx < len(vote_options):
-                            success = vote_manager.chat_vote(voter_key, vote_options[idx])
-                            if success:
-                                logger.debug("🗳️ 투표 성공: %s → %s", voter_key, vote_options[idx])
-                    elif cmd in vote_options:
-                        success = vote_manager.chat_vote(voter_key, cmd)
+                if flood_gate and not flood_gate.allow(voter_key):
+                    return
+                cmd = content[len("!투표"):].strip()
+                if vote_manager.approval:
+                    picks = parse_ballot(cmd, vote_options)
+                    if picks and vote_manager.chat_ballot(voter_key, picks):
+                        logger.debug("🗳️ 찬성 투표: %s → %s", voter_key, picks)
+                elif cmd.isdigit():
+                    idx = int(cmd) - 1
+                    if 0 <= idx < len(vote_options):
+                        success = vote_manager.chat_vote(voter_key, vote_options[idx])
                         if success:
-                            logger.debug("🗳️ 투표 성공: %s → %s", voter_key, cmd)
-            except Exception:
-                logger.exception("on_chat 처리 오류")
-        return on_chat
-
-    on_chat_callback = generate_chat_handler(vote_manager, vote_options)
-    listener = ChzzkSessionListener(ACCESS_TOKEN, on_chat_callback=on_chat_callback)
+                            logger.debug("🗳️ 투표 성공: %s → %s", voter_key, vote_options[idx])
+                elif cmd in vote_options:
+                    success = vote_manager.chat_vote(voter_key, cmd)
+                    if success:
+                        logger.debug("🗳️ 투표 성공: %s → %s", voter_key, cmd)
+        except Exception:
+            logger.exception("on_chat 처리 오류")
+    return on_chat
+
+def run_session_for_vote(vote_manager, vote_options, flood_gate=None, on_event=None, chat_dedup=None,
+                         api_base=None, transports=None):
+    on_chat_callback = make_chat_handler(vote_manager, vote_options, flood_gate, chat_dedup)
+    listener = ChzzkSessionListener(ACCESS_TOKEN, on_chat_callback=on_chat_callback, on_event=on_event,
+                                    api_base=api_base, transports=transports)
     t = threading.Thread(
         target=listener.run_forever,
         kwargs={"headers": {
@@ -455,14 +1662,18 @@ def run_session_for_vote(vote_manager, vote_options):
     )
     t.start()
 
-    time.sleep(1)
-
     return t, listener
 
 # -------------------------
 # 메시지 빌더 (문자열 안전 구성)
 # -------------------------
-def send_vote_status_notice(channel_id, access_token, options, votes, time_left):
+def _vote_howto():
+    """공지 끝에 붙는 참여 안내 (투표 방식에 맞춰)"""
+    if BALLOT_MODE == "approval":
+        return '채팅에 "!투표 1 3"처럼 원하는 효과를 모두 입력! 마감 전에 다시 보내면 변경됩니다.'
+    return '채팅에 "!투표 1"처럼 입력해 투표 참여!'
+
+def build_status_msg(options, votes, time_left):
     total = sum(votes.values())
     lines = []
     for idx, opt in enumerate(options, start=1):
@@ -472,16 +1683,16 @@ def send_vote_status_notice(channel_id, access_token, options, votes, time_left)
     msg = (
         f"[카오스 효과 투표 진행중] 남은 투표 가능시간: {time_left}초\n"
         + "\n".join(lines)
-        + '\n채팅에 "!투표 1"처럼 입력해 투표 참여!'
+        + "\n" + _vote_howto()
     )
-    send_chat_notice(channel_id, access_token, msg)
+    return msg
 
 def build_start_msg(options, duration_sec):
     notice_lines = "\n".join(f"{i}. {opt}" for i, opt in enumerate(options, start=1))
     return (
         f"[카오스 효과 투표 시작] 투표 가능시간: {duration_sec}초\n"
         f"{notice_lines}\n"
-        '채팅에 "!투표 1"처럼 입력해 투표 참여!'
+        f"{_vote_howto()}"
     )
 
 def build_result_msg(options, votes, winner, result_duration):
@@ -492,97 +1703,272 @@ def build_result_msg(options, votes, winner, result_duration):
         f"결과는 {result_duration}초 간 고정 유지됩니다."
     )
 
-def _notice_channel_id(listener, fallback_id):
-    """세션에서 받은 채널ID가 있으면 우선 사용, 없으면 config.channel_id"""
-    if listener and getattr(listener, "channel_id", None):
-        return listener.channel_id
-    return fallback_id
-
 # -------------------------
 # 메인 루프
 # -------------------------
-def main():
-    if RUNTIME <= 0:
-        logger.error("RUNTIME 값이 0 이하입니다. config.json의 runtime을 확인하세요.")
-        input("엔터를 눌러 종료.")
-        return
-    if VOTE_DURATION <= 0:
-        logger.error("vote_duration 값이 0 이하입니다. config.json을 확인하세요.")
-        input("엔터를 눌러 종료.")
-        return
-    if len(all_effects) < 3:
-        logger.error("모든 효과 이름.txt 에 최소 3개 이상의 효과가 필요합니다.")
-        input("엔터를 눌러 종료.")
-        return
-
-    start_time = time.time()
+class PreparedRound:
+    """
+    다음 라운드 준비물. 이전 라운드의 결과/대기 단계 동안 미리 만들어 두고
+    예정 시각(tick)에는 공지 전송 + 투표 열기만 한다.
+    """
+    def __init__(self, round_no, options, duration, session_factory=None, clock=None):
+        self.round_no = round_no
+        self.options = options
+        self.duration = duration
+        self.start_msg = build_start_msg(options, duration)
+        self.manager = new_vote_manager(options, voting=False, clock=clock)  # tick 전 채팅은 집계하지 않음
+        self.session_factory = session_factory or run_session_for_vote
+        self.thread = None
+        self.listener = None
+
+    def attach_listener(self, flood_gate, on_event=None, chat_dedup=None):
+        """세션 연결/구독을 백그라운드로 시작 (준비 여부는 listener.subscribed)"""
+        self.thread, self.listener = self.session_factory(self.manager, self.options, flood_gate,
+                                                          on_event, chat_dedup)
+
+    @property
+    def ready(self):
+        return self.listener is not None and self.listener.subscribed.is_set()
+
+    def discard(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.thread.join(timeout=5)
+
+class RoundSettings:
+    """
+    run_rounds 설정. 기본값은 config.json에서 읽은 값이고, 봇을 모듈로 불러 쓰는 도구
+    (soak.py 등)는 모듈 전역을 바꾸지 않고 필요한 항목만 키워드로 덮어쓴다.
+    ack_file을 따로 주지 않으면 save_dir/vote_ack.txt.
+    """
+    def __init__(self, **overrides):
+        self.vote_duration = VOTE_DURATION
+        self.result_duration = RESULT_DURATION
+        self.cooldown = NEXT_VOTE_WAIT
+        self.save_dir = SAVE_DIR
+        self.ack_file = None
+        self.ack_timeout = ACK_TIMEOUT
+        self.history_db = HISTORY_DB
+        self.fanout_port = FANOUT_PORT
+        self.api_base = OPENAPI_BASE
+        self.transports = SOCKET_TRANSPORTS
+        self.clock = CLOCK
+        for key, value in overrides.items():
+            if not hasattr(self, key):
+                raise TypeError(f"알 수 없는 라운드 설정: {key}")
+            setattr(self, key, value)
+        if self.ack_file is None:
+            self.ack_file = os.path.join(self.save_dir, "vote_ack.txt")
+
+def run_rounds(runtime, max_rounds=None, on_round_end=None, chat_dedup=None,
+               session_factory=None, notify=None, publish=None, settings=None):
+    """
+    라운드 반복 실행. runtime(봇 초) 또는 max_rounds 도달 시 종료, 완료 라운드 수 반환.
+    settings(RoundSettings) 기본값은 config 값, session_factory/notify/publish 기본값은
+    settings의 API 주소/저장 폴더를 쓰는 실제 세션/공지/결과 파일 (시뮬레이션에서 교체).
+    on_round_end(라운드 번호, 최종 득표)는 라운드 정리 후 호출.
+    """
+    settings = settings or RoundSettings()
+    clock = settings.clock
+    if session_factory is None:
+        def session_factory(manager, options, flood_gate, on_event, chat_dedup):
+            return run_session_for_vote(manager, options, flood_gate, on_event, chat_dedup,
+                                        api_base=settings.api_base, transports=settings.transports)
+    if notify is None:
+        def notify(channel_id, access_token, message):
+            send_chat_notice(channel_id, access_token, message, api_base=settings.api_base)
+    if publish is None:
+        def publish(winner, winners, generation, published_at):
+            return publish_vote_result(winner, winners, generation, published_at, save_dir=settings.save_dir)
+    start_time = clock.now()
     round_count = 0
-    
-    while (time.time() - start_time) < RUNTIME:
+    leaked_threads = 0
+    flood_gate = VoterFloodGate(window=FLOOD_WINDOW, burst=FLOOD_BURST, clock=clock)
+    if chat_dedup is None:
+        chat_dedup = ChatDedupCache(ttl=CHAT_DEDUP_TTL, capacity=CHAT_DEDUP_SIZE, clock=clock)
+    history = None
+    if settings.history_db:
+        try:
+            history = RoundHistoryStore(settings.history_db)
+        except Exception:
+            logger.exception("[HISTORY] 기록 DB 열기 실패 - 기록 없이 진행: %s", settings.history_db)
+    ack_tracker = EffectAckTracker(settings.ack_file, settings.ack_timeout,
+                                   on_ack=history.record_effect if history else None, clock=clock)
+    ack_tracker.reset()
+    fanout = None
+    if settings.fanout_port is not None:
+        try:
+            fanout = EventFanoutHub(FANOUT_HOST, int(settings.fanout_port), FANOUT_BUFFER, FANOUT_OVERFLOW).start()
+            logger.info("[FANOUT] 이벤트 허브 시작: %s:%d", FANOUT_HOST, fanout.port)
+        except Exception:
+            logger.exception("[FANOUT] 이벤트 허브 시작 실패 - 재배포 없이 진행")
+    on_event = fanout.publish if fanout else None
+    wait_msg = f"[카오스 효과 투표] 다음 투표까지 {settings.cooldown}초 대기 중."
+    start_lags = []
+
+    def prepare(round_no):
+        weights = EFFECT_WEIGHTS
+        if history and HISTORY_WEIGHTING:
+            try:
+                weights = history.suggest_weights(all_effects, EFFECT_WEIGHTS, last_n=HISTORY_WINDOW)
+            except Exception:
+                logger.exception("[HISTORY] 가중치 계산 실패 - 기본 가중치 사용")
+        options = pick_effects_with_weight(all_effects, weights, count=3)
+        return PreparedRound(round_no, options, int(settings.vote_duration), session_factory, clock)
+
+    def expired():
+        return clock.now() - start_time >= runtime or (
+            max_rounds is not None and round_count >= max_rounds)
+
+    # 첫 라운드는 앞 단계가 없으므로 여기서 준비 (채팅 구독 확인 최대 2초 - 채널 식별은 main에서 이미 끝남)
+    plan = None
+    if not expired():
+        plan = prepare(1)
+        plan.attach_listener(flood_gate, on_event, chat_dedup)
+        clock.wait(plan.listener.subscribed, 2)
+    scheduled_start = clock.now()
+
+    while plan is not None:
         round_count += 1
+        options, duration, t_manager = plan.options, plan.duration, plan.manager
+        t, listener = plan.thread, plan.listener
         logger.info("=" * 50)
         logger.info("라운드 %d 시작", round_count)
         logger.info("=" * 50)
-        
-        options = pick_effects_with_weight(all_effects, EFFECT_WEIGHTS, count=3)
-        duration = int(VOTE_DURATION)
-
-        t_manager = VoteManager(options)
-        t, listener = run_session_for_vote(t_manager, options)
-
-        # 구독 채널ID 확보 대기
-        for _ in range(40):  # 2초
-            if getattr(listener, "channel_id", None):
-                break
-            time.sleep(0.05)
-        notice_cid = _notice_channel_id(listener, CHANNEL_ID)
-
-        # 시작 공지
-        send_chat_notice(notice_cid, ACCESS_TOKEN, build_start_msg(options, duration))
 
-        # 투표 진행
-        for sec in range(duration, 0, -1):
-            if sec == duration // 2:
-                current_votes = t_manager.get_current_votes()
-                send_vote_status_notice(notice_cid, ACCESS_TOKEN, options, current_votes, sec)
-            time.sleep(1)
-
-        # 마감 및 결과 저장/공지
+        # 시작 공지 (예정 tick에 바로: 선택지/문구/구독은 이미 준비됨)
+        if not plan.ready:
+            logger.warning("[PIPELINE] 라운드 %d 구독 확인 전에 시작 (세션 연결 지연)", round_count)
+        notice_cid = CHANNEL_ID  # 시작 시 users/me로 확인 (라운드마다 구독 이벤트를 기다리지 않음)
+        t_manager.open_vote()
+        notify(notice_cid, ACCESS_TOKEN, plan.start_msg)
+        # 공지가 재시도로 늦어져도 시청자에게는 공지에 적힌 시간 전체를 줌 (투표는 tick부터 이미 열려 있음)
+        vote_end = clock.now() + duration
+        lag = clock.now() - scheduled_start
+        start_lags.append(lag)
+        logger.info("[PIPELINE] 라운드 %d: 쿨다운 종료 → 시작 공지 %.3fs", round_count, lag)
+
+        # 투표 진행 (절반 시점에 현황 공지)
+        status_at = vote_end - duration // 2
+        clock.sleep_until(status_at)
+        if duration // 2 > 0:
+            notify(notice_cid, ACCESS_TOKEN, build_status_msg(options, t_manager.get_current_votes(), duration // 2))
+        clock.sleep_until(vote_end)
+
+        # 마감 및 결과 저장/공지 (동표면 한 번에 multi로 기록 → Lua가 중간 상태를 읽지 않음)
+        closed_at = clock.now()
         winner = t_manager.end_vote()
-        save_vote_result_lua(winner)
-        save_vote_result_txt(winner)
-
         winners = t_manager.end_vote_multi()
-        if winners and len(winners) > 1:
-            save_vote_result_multi_lua(winners)
-            save_vote_result_multi_txt(winners)
+        logger.info("[FLOOD] %s", flood_gate.stats())
+        logger.info("[DEDUP] %s", chat_dedup.stats())
+        if fanout:
+            logger.info("[FANOUT] %s", fanout.stats())
+        generation = f"{int(start_time)}-{round_count}"
+        published_at = clock.now()
+        published = publish(winner, winners, generation, published_at)
+        if published:
+            ack_tracker.register(generation, published, closed_at, published_at)
 
         current_votes = t_manager.get_current_votes()
-        send_chat_notice(notice_cid, ACCESS_TOKEN, build_result_msg(options, current_votes, winner, RESULT_DURATION))
-
-        # 결과 고정 유지
-        for _ in range(int(RESULT_DURATION)):
-            time.sleep(1)
+        if history:
+            participants, timeline = t_manager.get_participation()
+            history.record_round(generation, t_manager.started_at, closed_at, options, current_votes,
+                                 winners or ([winner] if winner is not None else []), participants, timeline)
+        # 결과 문구는 최종 득표가 들어가므로 마감 시점에 생성
+        notify(notice_cid, ACCESS_TOKEN, build_result_msg(options, current_votes, winner, settings.result_duration))
+        result_end = clock.now() + settings.result_duration
+
+        # 결과 고정 유지 동안 다음 라운드 선택지/문구 준비 (그 사이 에뮬레이터 ACK 수집)
+        plan = None if expired() else prepare(round_count + 1)
+        clock.sleep_until(result_end, ack_tracker.poll)
 
         # 📻 라운드 끝: 소켓/스레드 정리 (중요)
         try:
             listener.stop()
+            if fanout and plan is not None:
+                # 다음 라운드 세션이 구독될 때까지 업스트림 이벤트를 받지 못함
+                fanout.publish("GAP", {"reason": "session_switch", "round": round_count})
             t.join(timeout=5)
+            if t.is_alive():
+                leaked_threads += 1
+                logger.warning("[LEAK] 라운드 %d 리스너 스레드가 5초 안에 끝나지 않음 (누적 %d개)",
+                               round_count, leaked_threads)
             del listener
             del t
             del t_manager
         except Exception:
             logger.exception("리소스 정리 중 예외")
 
-        # 다음 라운드 대기
-        wait_msg = f"[카오스 효과 투표] 다음 투표까지 {NEXT_VOTE_WAIT}초 대기 중."
-        send_chat_notice(notice_cid, ACCESS_TOKEN, wait_msg)
-        for _ in range(int(NEXT_VOTE_WAIT)):
-            time.sleep(1)
-
+        if on_round_end:
+            on_round_end(round_count, current_votes)
+        if plan is None:
+            break
+
+        # 다음 라운드 대기: tick을 먼저 고정하고, 대기 중에 다음 세션 연결/구독
+        scheduled_start = clock.now() + settings.cooldown
+        notify(notice_cid, ACCESS_TOKEN, wait_msg)
+        plan.attach_listener(flood_gate, on_event, chat_dedup)
+
+        def _cooldown_tick():
+            ack_tracker.poll()
+            ack_tracker.check_overdue()
+        clock.sleep_until(scheduled_start, _cooldown_tick)
+        logger.info("[ACK] %s", ack_tracker.summary())
+
+        if expired():
+            plan.discard()
+            plan = None
+
+    ack_tracker.poll()
+    ack_tracker.check_overdue()
+    if history:
+        history.close()
+    if fanout:
+        fanout.stop()
     logger.info("=" * 50)
-    logger.info("총 %d 라운드 완료 - 프로그램 종료", round_count)
+    logger.info("총 %d 라운드 완료", round_count)
+    logger.info("[ACK] %s", ack_tracker.summary())
+    if start_lags:
+        logger.info("[PIPELINE] 쿨다운 종료 → 시작 공지: 평균 %.3fs, 최대 %.3fs",
+                    sum(start_lags) / len(start_lags), max(start_lags))
     logger.info("=" * 50)
+    return round_count
+
+def main():
+    global CHANNEL_ID
+    if RUNTIME <= 0:
+        logger.error("RUNTIME 값이 0 이하입니다. config.json의 runtime을 확인하세요.")
+        input("엔터를 눌러 종료.")
+        return
+    if VOTE_DURATION <= 0:
+        logger.error("vote_duration 값이 0 이하입니다. config.json을 확인하세요.")
+        input("엔터를 눌러 종료.")
+        return
+    if len(all_effects) < 3:
+        logger.error("모든 효과 이름.txt 에 최소 3개 이상의 효과가 필요합니다.")
+        input("엔터를 눌러 종료.")
+        return
+    if BALLOT_MODE not in ("single", "approval"):
+        logger.error("ballot_mode 값은 single 또는 approval 이어야 합니다: %s", BALLOT_MODE)
+        input("엔터를 눌러 종료.")
+        return
+
+    # 토큰 주인 채널 확인 (캐시가 유효하면 네트워크 없이). config와 다르면 바로 알림
+    try:
+        identity = resolve_channel_identity(token_data)
+    except Exception:
+        logger.exception("[IDENTITY] 토큰 채널 확인 실패 - config.channel_id(%s)로 진행", CHANNEL_ID)
+        identity = None
+    if identity:
+        if CHANNEL_ID and CHANNEL_ID != identity["channelId"]:
+            logger.error("[IDENTITY] config.json channel_id(%s)와 토큰 채널(%s, %s)이 다릅니다. "
+                         "공지/채팅은 토큰 채널로 갑니다 - 설정 또는 토큰을 확인하세요.",
+                         CHANNEL_ID, identity["channelId"], identity.get("channelName"))
+        CHANNEL_ID = identity["channelId"]
+        logger.info("[IDENTITY] 채널: %s (%s)", identity.get("channelName"), CHANNEL_ID)
+
+    run_rounds(RUNTIME)
+    logger.info("프로그램 종료")
     input("엔터를 눌러 종료.")
 
 if __name__ == "__main__":
@@ -0,0 +1,381 @@
+# main.lua 결과 소비 쪽의 Python 재현 (SNES9x 없이 결과 파일 브리지 테스트용)
+#
+# - read_vote: vote_result.txt 1순위, vote_result.lua 2순위 / 읽은 파일만 비우기
+# - parse_effect_list: 따옴표 유/무, ',', '+', '|' 분할 / effect_id가 있으면 카탈로그로 바로 해석
+# - generation 중복 처리 방지, 효과별 120프레임 쿨다운, vote_ack.txt ACK 기록
+# - 60fps 가상 프레임 클록 위에서 on_frame을 돌림 (--speed 배속)
+#
+# 사용:
+#   python headless_consumer.py --dir <save_dir>        봇 옆에서 에뮬레이터 대신 결과 소비
+#   python headless_consumer.py --stress 2000           봇 기록 함수와 경쟁시켜 프로토콜 경합 리포트
+import os
+import re
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import tempfile
+import threading
+import importlib.util
+import multiprocessing
+
+from build_effect_catalog import read_lua_tables
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_FILE = os.path.join(APP_DIR, "chzzk_vote_chat Ver4.0.py")
+
+FILE_TXT = "vote_result.txt"
+FILE_LUA = "vote_result.lua"
+FILE_ACK = "vote_ack.txt"
+FPS = 60
+EFFECT_COOLDOWN_FRAMES = 120  # main.lua와 동일 (≒ 2초 @60fps)
+
+# ================= main.lua 파서 재현 =================
+_WS = " \t\r\n\f\v"  # Lua %s
+
+def _trim(s):
+    return s.strip(_WS) if s is not None else None
+
+def parse_effect_list(content):
+    m = (re.search(r'effect_name\s*=\s*"([^\r\n"]+)"', content)
+         or re.search(r"effect_name\s*=\s*'([^\r\n']+)'", content)
+         or re.search(r"effect_name\s*=\s*([^\r\n;]+)", content))
+    raw = _trim(m.group(1)) if m else None
+    if not raw:
+        return []
+    return [t for t in (_trim(x) for x in re.findall(r"[^,+|]+", raw)) if t]
+
+def parse_generation(content):
+    m = re.search(r"generation\s*=\s*([^\r\n;]+)", content)
+    return _trim(m.group(1)) if m else None
+
+def parse_effect_ids(content, catalog_by_id):
+    if not catalog_by_id:
+        return None
+    m = re.search(r"effect_id\s*=\s*([\d, ]+)", content)
+    if not m:
+        return None
+    items = []
+    for eid in re.findall(r"\d+", m.group(1)):
+        e = catalog_by_id.get(int(eid))
+        if not e:
+            return None
+        items.append({"kor": e["name"], "eng": e["handler"]})
+    return items or None
+
+def load_catalog_by_id(path):
+    """effect_catalog.json → { ID: {name, handler} } (main.lua는 같은 내용의 effect_catalog.lua를 읽음)"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return {e["id"]: e for e in json.load(f).get("effects", [])}
+
+# ================= 소비자 =================
+class HeadlessConsumer:
+    """
+    main.lua on_frame 한 프레임 = on_frame() 한 번.
+    mapping/handlers가 없으면 모든 이름을 그대로 유효한 효과로 취급.
+    on_read(frame, from, content), on_apply(frame, generation, items),
+    on_result(frame, generation, status, kor) 콜백으로 관찰.
+    """
+    def __init__(self, save_dir, mapping=None, handlers=None, catalog_by_id=None,
+                 cooldown_frames=EFFECT_COOLDOWN_FRAMES, write_acks=True,
+                 on_read=None, on_apply=None, on_result=None):
+        self.save_dir = save_dir
+        self.mapping = mapping
+        self.handlers = handlers
+        self.catalog_by_id = catalog_by_id
+        self.cooldown_frames = cooldown_frames
+        self.write_acks = write_acks
+        self.on_read = on_read
+        self.on_apply = on_apply
+        self.on_result = on_result
+        self.frame_no = 0
+        self.last_generation = None
+        self.recent = {}  # { eng: 남은 쿨다운 프레임 }
+
+    def _path(self, name):
+        return os.path.join(self.save_dir, name)
+
+    def _read_file(self, name):
+        try:
+            with open(self._path(name), "rb") as f:
+                c = f.read().decode("utf-8", errors="replace")
+        except OSError:
+            return None
+        return c or None
+
+    def _clear_file(self, which):
+        try:
+            with open(self._path(FILE_TXT if which == "txt" else FILE_LUA), "w", encoding="utf-8"):
+                pass
+        except OSError:
+            pass
+
+    def _eng(self, kor):
+        if self.mapping is None:
+            return kor
+        return self.mapping.get(kor)
+
+    def read_vote(self):
+        content = self._read_file(FILE_TXT)
+        source = "txt" if content else None
+        if not content:
+            content = self._read_file(FILE_LUA)
+            source = "lua" if content else None
+        if not content:
+            return None, None, None
+        if self.on_read:
+            self.on_read(self.frame_no, source, content)
+        items = parse_effect_ids(content, self.catalog_by_id)
+        if not items:
+            items = [{"kor": k, "eng": self._eng(k)} for k in parse_effect_list(content)]
+        if not items:
+            return None, None, None
+        return items, source, parse_generation(content)
+
+    def _ack(self, generation, status, kor):
+        if self.on_result:
+            self.on_result(self.frame_no, generation, status, kor)
+        if not (self.write_acks and generation):
+            return
+        with open(self._path(FILE_ACK), "a", encoding="utf-8") as f:
+            f.write(f"generation={generation};frame={self.frame_no};time={int(time.time())};"
+                    f"status={status};effect={kor}\n")
+
+    def on_frame(self):
+        self.frame_no += 1
+        items, source, generation = self.read_vote()
+        if items and generation and generation == self.last_generation:
+            # txt/lua 두 파일에 같은 결과가 있으므로 이미 처리한 세대는 비우기만
+            self._clear_file(source)
+        elif items:
+            self.last_generation = generation
+            if self.on_apply:
+                self.on_apply(self.frame_no, generation, items)
+            for item in items:
+                eng = item["eng"]
+                if not eng or (self.handlers is not None and eng not in self.handlers):
+                    self._ack(generation, "unknown", item["kor"])
+                elif eng not in self.recent:
+                    self.recent[eng] = self.cooldown_frames
+                    self._ack(generation, "started", item["kor"])
+                else:
+                    self._ack(generation, "cooldown", item["kor"])
+            self._clear_file(source)
+
+        # 쿨다운 감소 (tick_coroutines와 같은 순서: 파일 처리 뒤)
+        for k in list(self.recent):
+            self.recent[k] -= 1
+            if self.recent[k] <= 0:
+                del self.recent[k]
+
+class FrameClock:
+    """fps * speed 로 on_frame을 호출. 마감을 놓친 프레임 수(overruns)를 셈"""
+    def __init__(self, fps=FPS, speed=1.0):
+        self.period = 1.0 / (fps * speed)
+        self.overruns = 0
+
+    def run(self, on_frame, stop_event):
+        start = time.perf_counter()
+        n = 0
+        while not stop_event.is_set():
+            on_frame()
+            n += 1
+            delay = start + n * self.period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+
+def build_consumer(save_dir, lua_path=None, catalog_path=None, **kwargs):
+    """main.lua(매핑/핸들러)와 effect_catalog.json이 있으면 그대로 반영한 소비자"""
+    mapping = handlers = None
+    if lua_path and os.path.exists(lua_path):
+        mapping, handlers = read_lua_tables(lua_path)
+    catalog = load_catalog_by_id(catalog_path) if catalog_path else None
+    return HeadlessConsumer(save_dir, mapping, handlers, catalog, **kwargs)
+
+# ================= 스트레스 =================
+def load_bot(path=BOT_FILE):
+    """
+    봇 스크립트를 모듈로 불러옴. 모듈로 불러오면 봇은 로그 설정/입력 대기를 하지 않고,
+    config.json/access_token.json이 없으면 기본값, 효과 목록 등 필수 파일이 없으면 바로 예외를 낸다.
+    """
+    spec = importlib.util.spec_from_file_location("chzzk_vote_chat", path)
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    return bot
+
+def _percentile(values, q):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def _consumer_process(save_dir, lua_path, catalog_path, speed, frame, events, stop):
+    """에뮬레이터처럼 별도 프로세스에서 소비 (같은 프로세스 스레드면 GIL이 파일 I/O 경합을 가림)"""
+    consumer = build_consumer(
+        save_dir, lua_path, catalog_path,
+        on_read=lambda f, source, content: events.put(("read", f, source, content)),
+        on_apply=lambda f, generation, items: events.put(("apply", f, generation)),
+        on_result=lambda f, generation, status, kor: events.put(("result", f, generation, status)),
+    )
+    clock = FrameClock(speed=speed)
+
+    def step():
+        consumer.on_frame()
+        frame.value = consumer.frame_no
+
+    clock.run(step, stop)
+    events.put(("done", consumer.frame_no, clock.overruns))
+
+def stress(rounds=2000, interval_frames=6, speed=4.0, tie_ratio=0.2, empty_ratio=0.05,
+           seed=None, bot_file=BOT_FILE, lua_path=None, catalog_path=None):
+    """
+    봇 기록 함수(publish_vote_result)를 interval_frames마다 호출하고, 소비자는 별도 프로세스에서 돌림.
+    리포트: 찢어진 읽기(torn), 유실(lost), 중복 적용(double), 발행→처리 프레임 지연.
+    """
+    try:
+        bot = load_bot(bot_file)
+    except Exception as e:
+        print(f"[오류] 봇 모듈을 불러올 수 없습니다 ({bot_file}): {e}")
+        return 1
+    lua_path = lua_path or os.path.join(os.path.dirname(bot_file), "main.lua")
+    catalog_path = catalog_path or bot.EFFECT_CATALOG_FILE
+    rng = random.Random(seed)
+    work_dir = tempfile.mkdtemp(prefix="consumer_stress_")
+
+    frame = multiprocessing.Value("l", 0)
+    events = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    proc = multiprocessing.Process(
+        target=_consumer_process,
+        args=(work_dir, lua_path, catalog_path, speed, frame, events, stop),
+        daemon=True,
+    )
+    proc.start()
+    period = 1.0 / (FPS * speed)
+
+    published = {}   # generation -> (names, 발행 프레임)
+    effects = list(bot.all_effects)
+    empty = 0
+    try:
+        for n in range(1, rounds + 1):
+            target = frame.value + interval_frames
+            while frame.value < target:
+                time.sleep(period / 4)
+            if rng.random() < empty_ratio:
+                winner, winners = None, []
+            elif rng.random() < tie_ratio:
+                winners = rng.sample(effects, rng.choice((2, 3)))
+                winner = winners[0]
+            else:
+                winner = rng.choice(effects)
+                winners = [winner]
+            generation = f"stress-{n}"
+            at_frame = frame.value
+            names = bot.publish_vote_result(winner, winners, generation, time.time(), save_dir=work_dir)
+            if names:
+                published[generation] = (names, at_frame)
+            else:
+                empty += 1
+        # 마지막 결과가 처리될 시간
+        target = frame.value + max(interval_frames, 10)
+        while frame.value < target:
+            time.sleep(period)
+    finally:
+        stop.set()
+
+    handled = {}     # generation -> 처리된 on_frame 분기 횟수
+    statuses = {}    # status -> 개수
+    torn = []        # (frame, source, content)
+    latency = []     # 발행 → 처리 프레임
+    frames = overruns = 0
+    while True:
+        try:
+            ev = events.get(timeout=10)
+        except queue.Empty:
+            break
+        kind = ev[0]
+        if kind == "read":
+            _, f, source, content = ev
+            expected = published.get(parse_generation(content))
+            if expected is None or parse_effect_list(content) != expected[0]:
+                torn.append((f, source, content))
+        elif kind == "apply":
+            _, f, generation = ev
+            handled[generation] = handled.get(generation, 0) + 1
+            if handled[generation] == 1 and generation in published:
+                latency.append(f - published[generation][1])
+        elif kind == "result":
+            statuses[ev[3]] = statuses.get(ev[3], 0) + 1
+        elif kind == "done":
+            _, frames, overruns = ev
+            break
+    proc.join(timeout=5)
+
+    lost = [g for g in published if g not in handled]
+    double = [g for g, c in handled.items() if c > 1]
+    report = {
+        "rounds": rounds,
+        "published": len(published),
+        "empty": empty,
+        "frames": frames,
+        "frame_overruns": overruns,
+        "statuses": statuses,
+        "torn_reads": len(torn),
+        "lost": len(lost),
+        "double_applied": len(double),
+        "latency_frames": {
+            "p50": _percentile(latency, 0.5),
+            "p95": _percentile(latency, 0.95),
+            "max": max(latency, default=0),
+        },
+        "work_dir": work_dir,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    for f, source, content in torn[:5]:
+        print(f"[TORN] frame={f} {source}: {content!r}")
+    if lost:
+        print("[LOST]", ", ".join(lost[:10]))
+    if double:
+        print("[DOUBLE]", ", ".join(double[:10]))
+    return 0 if not (torn or lost or double) else 1
+
+# ================= 단독 실행 =================
+def serve(save_dir, speed=1.0, lua_path=None, catalog_path=None):
+    """에뮬레이터 대신 결과 파일을 소비하며 적용 결과를 출력 (Ctrl+C 종료)"""
+    def on_result(frame, generation, status, kor):
+        print(f"[frame {frame}] generation={generation} {status}: {kor}")
+
+    consumer = build_consumer(save_dir, lua_path, catalog_path, on_result=on_result)
+    stop = threading.Event()
+    try:
+        FrameClock(speed=speed).run(consumer.on_frame, stop)
+    except KeyboardInterrupt:
+        stop.set()
+    return 0
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="main.lua 결과 소비 쪽 헤드리스 재현")
+    ap.add_argument("--dir", default=APP_DIR, help="vote_result.* 가 있는 폴더 (봇 save_dir)")
+    ap.add_argument("--lua", default=os.path.join(APP_DIR, "main.lua"))
+    ap.add_argument("--catalog", default=os.path.join(APP_DIR, "effect_catalog.json"))
+    ap.add_argument("--speed", type=float, default=None, help="프레임 클록 배속 (기본: 단독 1, 스트레스 4)")
+    ap.add_argument("--stress", type=int, metavar="ROUNDS", help="봇 기록 함수와 경쟁시키는 스트레스 모드")
+    ap.add_argument("--interval-frames", type=int, default=6, help="스트레스: 라운드 결과 발행 간격(프레임)")
+    ap.add_argument("--tie-ratio", type=float, default=0.2)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--bot", default=BOT_FILE)
+    args = ap.parse_args(argv)
+
+    if args.stress:
+        return stress(args.stress, args.interval_frames, args.speed or 4.0, args.tie_ratio,
+                      seed=args.seed, bot_file=args.bot, lua_path=args.lua, catalog_path=args.catalog)
+    return serve(args.dir, args.speed or 1.0, args.lua, args.catalog)
+
+if __name__ == "__main__":
+    sys.exit(main())
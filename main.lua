@@ -7,6 +7,8 @@
 -- - effect_name에 여러 개(쉼표/플러스/|)면 동시에 실행
 -- - 아머(0x1FD0) 부위별 비트 해제 지원
 -- - 실행 로그 및 예외 방지, 중복 스팸 방지(짧은 쿨다운)
+-- - generation 있는 결과는 vote_ack.txt에 적용/거부 기록(ACK)을 남김
+-- - effect_id=ID[,ID] 가 있고 effect_catalog.lua가 있으면 이름 파싱/매핑 없이 ID로 바로 실행
 ------------------------------------------------------------
 
 ---------------------------
@@ -14,6 +16,8 @@
 ---------------------------
 local FILE_TXT = "vote_result.txt"
 local FILE_LUA = "vote_result.lua"
+local FILE_ACK = "vote_ack.txt"
+local FILE_CATALOG = "effect_catalog.lua"  -- build_effect_catalog.py 생성물
 
 -- 아머 비트 매핑(기본: Head=1, Arm=2, Body=4, Legs=8)
 local ARMOR_ADDR = 0x1FD0
@@ -104,6 +108,20 @@ local effect_kor_to_eng = {
     ["보스는 한발로 충분해"] = "Kill Boss 1 Hit",
 }
 
+---------------------------
+-- 2-1) 컴파일된 효과 카탈로그: { [ID] = { name = 한글, handler = 영문 } }
+--      없으면 위 한글 → 영문 매핑만 사용
+---------------------------
+local catalog_by_id = nil
+do
+    local ok, cat = pcall(dofile, FILE_CATALOG)
+    if ok and type(cat) == "table" then
+        catalog_by_id = cat
+    else
+        log("[Chaos] effect_catalog.lua 없음 - 효과 이름으로 처리")
+    end
+end
+
 ---------------------------
 -- 3) 유틸 / 파일 I/O / 파서
 ---------------------------
@@ -141,6 +159,27 @@ local function parse_effect_list(content)
     return list
 end
 
+-- generation=값 (없으면 nil: 구버전 봇 결과)
+local function parse_generation(content)
+    return trim(content:match("generation%s*=%s*([^\r\n;]+)"))
+end
+
+-- effect_id=3,7 → { {kor=, eng=}, ... } (카탈로그 없거나 모르는 ID가 있으면 nil → 이름으로 폴백)
+local function parse_effect_ids(content)
+    if not catalog_by_id then return nil end
+    local raw = content:match("effect_id%s*=%s*([%d, ]+)")
+    if not raw then return nil end
+    local list = {}
+    for id in raw:gmatch("%d+") do
+        local e = catalog_by_id[tonumber(id)]
+        if not e then return nil end
+        table.insert(list, { kor = e.name, eng = e.handler })
+    end
+    if #list == 0 then return nil end
+    return list
+end
+
+-- 반환: { {kor=한글, eng=영문 또는 nil}, ... }, 읽은 파일("txt"/"lua"), generation
 local function read_vote()
     local content = read_file(FILE_TXT)
     local from = content and "txt" or nil
@@ -148,10 +187,30 @@ local function read_vote()
         content = read_file(FILE_LUA)
         from = content and "lua" or nil
     end
-    if not content then return nil, nil end
-    local names = parse_effect_list(content)
-    if #names == 0 then return nil, nil end
-    return names, from
+    if not content then return nil, nil, nil end
+    local items = parse_effect_ids(content)
+    if not items then
+        items = {}
+        for _, kor_name in ipairs(parse_effect_list(content)) do
+            table.insert(items, { kor = kor_name, eng = effect_kor_to_eng[kor_name] })
+        end
+    end
+    if #items == 0 then return nil, nil, nil end
+    return items, from, parse_generation(content)
+end
+
+---------------------------
+-- 3-1) ACK 기록: 봇이 효과 적용 시점/거부 사유를 알 수 있도록 한 줄씩 추가
+---------------------------
+local frame_no = 0
+local last_generation = nil
+
+local function write_ack(generation, status, kor_name)
+    if not generation then return end
+    local f = io.open(FILE_ACK, "a"); if not f then return end
+    f:write(string.format("generation=%s;frame=%d;time=%d;status=%s;effect=%s\n",
+        generation, frame_no, os.time(), status, tostring(kor_name)))
+    f:close()
 end
 
 ---------------------------
@@ -446,32 +505,42 @@ end,
 -- 7) 프레임 콜백: 매 프레임 투표파일 확인 & 코루틴 스텝
 ---------------------------
 local function on_frame()
+    frame_no = frame_no + 1
+
     -- 7-1) 파일 확인
-    local kor_list, from = read_vote()
-    if kor_list and #kor_list > 0 then
-        -- 한글 → 영문 변환, 유효한 것만 남김
+    local items, from, generation = read_vote()
+    if items and generation and generation == last_generation then
+        -- txt/lua 두 파일에 같은 결과가 있으므로 이미 처리한 세대는 비우기만
+        if from then clear_file(from) end
+    elseif items then
+        last_generation = generation
+
+        -- 핸들러가 있는 것만 남김
         local eng_list = {}
-        for _, kor_name in ipairs(kor_list) do
-            local eng = effect_kor_to_eng[kor_name]
-            if not eng then
-                log("[Chaos] 알 수 없는 효과: " .. tostring(kor_name))
+        for _, item in ipairs(items) do
+            if not item.eng or not effects[item.eng] then
+                log("[Chaos] 알 수 없는 효과: " .. tostring(item.kor))
+                write_ack(generation, "unknown", item.kor)
             else
-                table.insert(eng_list, eng)
+                table.insert(eng_list, item)
             end
         end
 
         -- 유효 항목 있으면 시작
         if #eng_list > 0 then
-            for _, eng in ipairs(eng_list) do
+            for _, item in ipairs(eng_list) do
+                local eng = item.eng
                 if not recent[eng] then
                     log("[Chaos] 효과 시작: " .. tostring(eng))
                     start_effect(function()
                         effects[eng]()  -- 내부의 emu.frameadvance()는 yield로 동작
                     end)
                     recent[eng] = EFFECT_COOLDOWN_FRAMES
+                    write_ack(generation, "started", item.kor)
                 else
                     -- 쿨다운 중이면 무시(스팸 방지)
                     -- log("[Chaos] 쿨다운 중 스킵: " .. tostring(eng))
+                    write_ack(generation, "cooldown", item.kor)
                 end
             end
         end
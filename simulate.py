@@ -0,0 +1,239 @@
+# 가상 시계 시뮬레이션: 합성 시청자로 run_rounds를 그대로 돌려 방송 몇 시간을 몇 초에 재현
+#
+# - 봇은 모듈로 불러와 run_rounds를 RoundSettings(가상 시계/임시 폴더)로 실행 → config/토큰 없이도 동작
+# - 소켓/공지/결과 파일 없음, 라운드 기록은 임시 SQLite → 라운드 시간/효과 빈도/득표 리포트(JSON)
+# - 단계 시간/방송 시간은 config.json 값(없으면 봇 기본값), 인자로 덮어쓸 수 있음
+#
+# 사용:
+#   python simulate.py                    runtime 한 방송 분량
+#   python simulate.py 500 --seed 1       500 라운드
+#   python simulate.py --viewers 5000 --chat-rate 80 --report sim.json
+import os
+import sys
+import json
+import time
+import random
+import logging
+import sqlite3
+import argparse
+import tempfile
+import threading
+
+from headless_consumer import BOT_FILE, load_bot
+
+# ================= 합성 시청자 =================
+class _SimSession:
+    """run_session_for_vote 대역. 스레드 없이 가상 시계 콜백으로 매 초 합성 채팅을 넣음"""
+    def __init__(self, audience, vote_manager, vote_options, on_chat):
+        self.audience = audience
+        self.vote_manager = vote_manager
+        self.vote_options = vote_options
+        self.on_chat = on_chat
+        self.channel_id = audience.channel_id
+        self.subscribed = threading.Event()
+        self.subscribed.set()
+        self.running = True
+        self.clock = audience.clock
+        self.clock.call_at(self.clock.now() + 1.0, self._tick)
+
+    def _tick(self):
+        if not self.running:
+            return
+        if self.vote_manager.voting:  # 투표 전/후 채팅은 어차피 집계되지 않으므로 생략
+            self.audience.chat(self.vote_options, self.on_chat)
+        self.clock.call_at(self.clock.now() + 1.0, self._tick)
+
+    def stop(self):
+        self.running = False
+
+    def join(self, timeout=None):
+        pass
+
+    def is_alive(self):
+        return False
+
+class SyntheticAudience:
+    """
+    합성 시청자 viewers 명. 투표 중 매 초 평균 chat_rate 개의 "!투표 N" 채팅을 보낸다.
+    시청자마다 좋아하는 효과가 하나 있어, 선택지에 있으면 loyalty 확률로 그것을 고르고 아니면 무작위.
+    채팅은 실제 세션과 같은 봇의 make_chat_handler(중복/도배/재투표 처리)를 거친다.
+    """
+    def __init__(self, bot, effects, viewers=1000, chat_rate=20.0, loyalty=0.5, seed=None, clock=None):
+        self.bot = bot
+        self.clock = clock or bot.CLOCK
+        self.channel_id = bot.CHANNEL_ID
+        self.rng = random.Random(seed)
+        self.viewers = max(1, int(viewers))
+        self.chat_rate = max(0.0, float(chat_rate))
+        self.loyalty = loyalty
+        self.favorite = [self.rng.choice(effects) for _ in range(self.viewers)]
+        self.sent = 0
+
+    def attach(self, vote_manager, vote_options, flood_gate=None, on_event=None, chat_dedup=None):
+        """PreparedRound.session_factory 시그니처 (thread, listener) - 둘 다 같은 세션"""
+        on_chat = self.bot.make_chat_handler(vote_manager, vote_options, flood_gate, chat_dedup)
+        session = _SimSession(self, vote_manager, vote_options, on_chat)
+        return session, session
+
+    def chat(self, options, on_chat):
+        rng = self.rng
+        count = int(self.chat_rate) + (rng.random() < self.chat_rate % 1)
+        now_ms = int(self.clock.now() * 1000)
+        for _ in range(count):
+            v = rng.randrange(self.viewers)
+            fav = self.favorite[v]
+            if fav in options and rng.random() < self.loyalty:
+                pick = options.index(fav) + 1
+            else:
+                pick = rng.randint(1, len(options))
+            self.sent += 1
+            on_chat({
+                "senderChannelId": f"viewer{v}",
+                "content": f"!투표 {pick}",
+                "messageTime": now_ms + self.sent,  # 중복 차단 키가 겹치지 않도록
+            })
+
+# ================= 리포트 =================
+def _sim_report(bot, db_path, rounds, virtual_seconds, wall_seconds, audience, notices):
+    """시뮬레이션 기록 DB → 라운드 시간/효과 빈도/득표 통계 dict"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT started_at, closed_at, tie, participants, total_votes FROM rounds ORDER BY started_at"
+        ).fetchall()
+        rollup = {e: (offered, wins, votes) for e, offered, wins, votes in conn.execute(
+            "SELECT effect, offered, wins, votes FROM effect_rollup")}
+    finally:
+        conn.close()
+
+    def _avg(xs):
+        return round(sum(xs) / len(xs), 3) if xs else None
+
+    vote_secs = [closed - started for started, closed, _, _, _ in rows]
+    periods = [b[0] - a[0] for a, b in zip(rows, rows[1:])]
+    totals = [r[4] for r in rows]
+    weights = bot.EFFECT_WEIGHTS
+    weight_sum = sum(weights.get(e, 10) for e in bot.all_effects) or 1
+    offered_sum = sum(o for o, _, _ in rollup.values()) or 1
+    effects = {}
+    for e in bot.all_effects:
+        offered, wins, votes = rollup.get(e, (0, 0, 0))
+        effects[e] = {
+            "weight": weights.get(e, 10),
+            "weight_share": round(weights.get(e, 10) / weight_sum, 4),
+            "offered": offered,
+            "offered_share": round(offered / offered_sum, 4),
+            "wins": wins,
+            "win_rate": round(wins / offered, 4) if offered else None,
+            "votes": votes,
+        }
+    return {
+        "rounds": rounds,
+        "virtual_seconds": round(virtual_seconds, 1),
+        "wall_seconds": round(wall_seconds, 3),
+        "speedup": round(virtual_seconds / wall_seconds) if wall_seconds > 0 else None,
+        "timing": {
+            "vote_seconds_avg": _avg(vote_secs),
+            "round_period_avg": _avg(periods),
+            "round_period_max": round(max(periods), 3) if periods else None,
+            "rounds_per_hour": round(3600 / _avg(periods), 2) if periods else None,
+        },
+        "votes": {
+            "total": sum(totals),
+            "per_round_avg": _avg(totals),
+            "per_round_min": min(totals) if totals else None,
+            "per_round_max": max(totals) if totals else None,
+            "participants_avg": _avg([r[3] for r in rows]),
+            "no_vote_rounds": sum(1 for t in totals if t == 0),
+            "tie_rounds": sum(1 for r in rows if r[2]),
+        },
+        "audience": {"viewers": audience.viewers, "chat_rate": audience.chat_rate, "chats_sent": audience.sent},
+        "notices": notices,
+        "effects": effects,
+    }
+
+# ================= 실행 =================
+def simulate(rounds=None, runtime=None, vote_duration=None, result_duration=None, cooldown=None,
+             viewers=1000, chat_rate=20.0, loyalty=0.5, seed=None, report_path=None, bot_file=BOT_FILE):
+    """
+    가상 시계로 run_rounds 전체를 실행하고 리포트(JSON)를 출력. rounds가 없으면 runtime
+    (기본 config runtime) 한 방송 분량. 단계 시간은 config 값, 인자로 덮어쓸 수 있음.
+    공지는 개수만 세고, 결과는 파일 대신 기록만 한다 (ACK가 없으므로 적용 확인은 전부 미소비).
+    """
+    if not os.getenv("CHZZK_LOG"):
+        logging.basicConfig(level=logging.ERROR)  # 미소비 ACK 경고 등 반복 로그 숨김
+    try:
+        bot = load_bot(bot_file)
+    except Exception as e:
+        print(f"[오류] 봇 모듈을 불러올 수 없습니다 ({bot_file}): {e}")
+        return 1
+
+    stages = {}
+    if vote_duration is not None:
+        stages["vote_duration"] = int(vote_duration)
+    if result_duration is not None:
+        stages["result_duration"] = int(result_duration)
+    if cooldown is not None:
+        stages["cooldown"] = int(cooldown)
+    if seed is not None:
+        random.seed(seed)  # 선택지 추첨 (봇의 pick_effects_with_weight)
+    workdir = tempfile.mkdtemp(prefix="chzzk_sim_")
+    settings = bot.RoundSettings(
+        save_dir=workdir,
+        history_db=os.path.join(workdir, "vote_history.sqlite3"),  # 리포트 원본이라 설정과 무관하게 기록
+        fanout_port=None,
+        clock=bot.VirtualClock(start=time.time()),  # 세대 ID/기록 시각이 실제 시각처럼 보이도록
+        **stages,
+    )
+    clock = settings.clock
+
+    notices = {"count": 0}
+
+    def notify(_channel_id, _token, _message):
+        notices["count"] += 1
+
+    def publish(winner, winners, _generation, _published_at):
+        if winners and len(winners) > 1:
+            return list(winners)
+        return [winner] if winner is not None else []
+
+    audience = SyntheticAudience(bot, bot.all_effects, viewers, chat_rate, loyalty, seed, clock=clock)
+    v0, t0 = clock.now(), time.perf_counter()
+    if rounds:
+        done = bot.run_rounds(float("inf"), max_rounds=rounds, session_factory=audience.attach,
+                              notify=notify, publish=publish, settings=settings)
+    else:
+        done = bot.run_rounds(runtime or bot.RUNTIME, session_factory=audience.attach, notify=notify,
+                              publish=publish, settings=settings)
+    wall = time.perf_counter() - t0
+
+    report = _sim_report(bot, settings.history_db, done, clock.now() - v0, wall, audience, notices["count"])
+    report["workdir"] = workdir
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if report_path:
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+    print("[SIM] %d 라운드, 가상 %.0fs / 실제 %.2fs (x%s), 작업 폴더 %s" % (
+        done, report["virtual_seconds"], wall, report["speedup"], workdir))
+    return 0
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="가상 시계 시뮬레이션 (합성 시청자, 소켓 없음)")
+    ap.add_argument("rounds", type=int, nargs="?", default=0, help="라운드 수 (생략 시 runtime 한 방송 분량)")
+    ap.add_argument("--runtime", type=float, default=None, help="가상 방송 시간(초), 기본 config runtime")
+    ap.add_argument("--vote-duration", type=int, default=None)
+    ap.add_argument("--result-duration", type=int, default=None)
+    ap.add_argument("--cooldown", type=int, default=None)
+    ap.add_argument("--viewers", type=int, default=1000)
+    ap.add_argument("--chat-rate", type=float, default=20.0, help="투표 중 초당 평균 채팅 수")
+    ap.add_argument("--loyalty", type=float, default=0.5, help="좋아하는 효과가 있으면 고를 확률")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--report", default=None, help="리포트 JSON 저장 경로")
+    ap.add_argument("--bot", default=BOT_FILE)
+    args = ap.parse_args(argv)
+    return simulate(args.rounds, args.runtime, args.vote_duration, args.result_duration, args.cooldown,
+                    args.viewers, args.chat_rate, args.loyalty, args.seed, args.report, bot_file=args.bot)
+
+if __name__ == "__main__":
+    sys.exit(main())
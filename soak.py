@@ -0,0 +1,396 @@
+# 라운드 루프 장시간(소크) 테스트: 로컬 CHZZK 대역 서버 + 자원 누수 감지
+#
+# - 대역 서버(Open API REST + Socket.IO polling)는 자식 프로세스에서 돌려 측정에 섞이지 않게 함
+# - 봇은 모듈로 불러와 run_rounds를 RoundSettings(배속 시계/짧은 단계/임시 폴더)로 실행
+# - sample_every 라운드마다 tracemalloc/스레드 수/FD 수를 재고, 채팅 수신/집계 수를 리포트
+#
+# 사용:
+#   python soak.py 2000                   2000 라운드 (기본 20배속)
+#   python soak.py 500 --replay 0.3       대역 서버가 채팅을 재전송 (중복 차단 확인)
+#   python soak.py --dedup-check          중복 차단 결정적 확인만 (가상 시계, 소켓 없음 - 소크 시작 시에도 실행)
+import os
+import sys
+import gc
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import multiprocessing
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+import socketio  # python-socketio (봇과 같은 의존성)
+
+from headless_consumer import BOT_FILE, load_bot
+
+CHAT_PER_ROUND = 30
+VOTERS = 20
+EMIT_BATCH = 8  # polling 응답 1회에 16패킷 넘으면 클라이언트가 끊음
+
+# ================= 대역 서버 =================
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class LocalChzzkStandIn:
+    """
+    Open API REST(세션 URL/구독/공지/users/me) + Socket.IO 세션을 흉내내는 로컬 서버.
+    wsgiref 기반이라 websocket 대신 polling 전송만 지원한다.
+    구독 요청이 오면 SYSTEM subscribed만 보내고, "투표 시작" 공지가 오면 그때 마지막으로 구독한
+    세션에 가짜 투표 채팅 chat_per_round 개를 spread 초에 걸쳐 EMIT_BATCH 개씩 나눠 보낸다
+    (봇은 다음 라운드 세션을 대기 중에 미리 구독하므로 구독 시점에 보내면 전부 투표 전에 도착).
+    공지 시점에 구독된 세션이 없으면(첫 라운드 연결 지연) 투표 창(2 * spread) 안에 구독하는 세션에 보낸다.
+    replay 비율만큼 같은 라운드/직전 라운드 채팅을 그대로 다시 보내 재전송을 흉내낸다.
+    """
+    def __init__(self, chat_per_round=CHAT_PER_ROUND, voters=VOTERS, channel_id="standin-channel",
+                 replay=0.0, spread=0.02):
+        self.chat_per_round = chat_per_round
+        self.voters = voters
+        self.channel_id = channel_id
+        self.replay = replay
+        self.spread = spread
+        self.notices = 0
+        self.sent = 0
+        self.replayed = 0
+        self._last_round = []
+        self._current_sid = None  # 마지막으로 CHAT 구독한 세션
+        self._pending_until = 0.0  # 구독 전에 온 "투표 시작" 공지의 유효 시각
+        self.sio = socketio.Server(async_mode="threading", cors_allowed_origins="*",
+                                   logger=False, engineio_logger=False)
+        self.sio.on("connect", self._on_connect)
+        self.sio.on("disconnect", self._on_disconnect)
+        self._server = make_server("127.0.0.1", 0, socketio.WSGIApp(self.sio, self._rest),
+                                   server_class=_ThreadingWSGIServer, handler_class=_QuietHandler)
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="standin-http", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _on_connect(self, sid, environ, auth=None):
+        self.sio.emit("SYSTEM", {"type": "connected", "data": {"sessionKey": sid}}, to=sid)
+
+    def _on_disconnect(self, sid, *args):
+        if sid == self._current_sid:
+            self._current_sid = None
+
+    def _round_batch(self):
+        now_ms = int(time.time() * 1000)
+        fresh = [{
+            "senderChannelId": f"voter{random.randrange(self.voters)}",
+            "content": f"!투표 {random.randint(1, 3)}",
+            "messageTime": now_ms + i,
+        } for i in range(self.chat_per_round)]
+        batch = []
+        if self.replay:
+            # 재연결 직후처럼 직전 라운드 채팅을 먼저 재전송, 이번 라운드 채팅은 바로 뒤에 한 번 더
+            batch += [m for m in self._last_round if random.random() < self.replay]
+            for m in fresh:
+                batch.append(m)
+                if random.random() < self.replay:
+                    batch.append(m)
+            self.replayed += len(batch) - len(fresh)
+        else:
+            batch = fresh
+        self._last_round = fresh
+        self.sent += len(fresh)
+        return batch
+
+    def _emit_chats(self, sid, batch):
+        chunks = [batch[i:i + EMIT_BATCH] for i in range(0, len(batch), EMIT_BATCH)]
+        gap = self.spread / max(1, len(chunks))
+        for i, chunk in enumerate(chunks):
+            if i:
+                self.sio.sleep(gap)
+            for msg in chunk:
+                self.sio.emit("CHAT", msg, to=sid)
+
+    def _on_subscribe(self, sid):
+        self.sio.emit("SYSTEM", {"type": "subscribed",
+                                 "data": {"eventType": "CHAT", "channelId": self.channel_id}}, to=sid)
+        self._current_sid = sid
+        if self._pending_until > time.time():
+            self._pending_until = 0.0
+            self._emit_chats(sid, self._round_batch())
+
+    def _on_notice(self, message):
+        self.notices += 1
+        if "투표 시작" not in message:
+            return
+        sid = self._current_sid
+        if sid is None:
+            self._pending_until = time.time() + 2 * self.spread
+            return
+        self.sio.start_background_task(self._emit_chats, sid, self._round_batch())
+
+    def _rest(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        qs = environ.get("QUERY_STRING", "")
+        body = {"code": 200, "content": {}}
+        if path == "/open/v1/sessions/auth":
+            body["content"] = {"url": self.base_url}
+        elif path == "/open/v1/sessions/events/subscribe/chat":
+            sid = dict(p.split("=", 1) for p in qs.split("&") if "=" in p).get("sessionKey")
+            if sid:
+                self.sio.start_background_task(self._on_subscribe, sid)
+        elif path == "/open/v1/chats/notice":
+            try:
+                raw = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+                message = json.loads(raw or b"{}").get("message", "")
+            except ValueError:
+                message = ""
+            self._on_notice(message)
+        elif path == "/open/v1/users/me":
+            body["content"] = {"channelId": self.channel_id, "channelName": "standin"}
+        else:
+            start_response("404 Not Found", [("Content-Type", "application/json")])
+            return [b"{}"]
+        start_response("200 OK", [("Content-Type", "application/json")])
+        return [json.dumps(body).encode("utf-8")]
+
+def _serve_standin(conn, replay=0.0, spread=0.02):
+    """자식 프로세스에서 대역 서버 실행 (소크 측정에 서버 스레드/메모리가 섞이지 않도록)"""
+    standin = LocalChzzkStandIn(replay=replay, spread=spread).start()
+    conn.send(standin.base_url)
+    conn.recv()  # 부모가 종료 신호를 보낼 때까지 대기
+    standin.stop()
+    conn.send({"sent": standin.sent, "replayed": standin.replayed, "notices": standin.notices})
+
+# ================= 중복 차단 결정적 확인 =================
+def _fake_round(rng, round_no, chats, voters):
+    """한 라운드의 깨끗한 채팅 (절반은 messageId, 절반은 messageTime으로 키가 만들어짐)"""
+    out = []
+    for i in range(chats):
+        msg = {"senderChannelId": f"viewer{rng.randrange(voters)}",
+               "content": f"!투표 {rng.randint(1, 3)}",
+               "messageTime": round_no * 1_000_000 + i}
+        if i % 2:
+            msg["messageId"] = f"r{round_no}-{i}"
+        out.append(msg)
+    return out
+
+def dedup_check(bot, seed=0, chats=200, voters=60, dup_ratio=0.3):
+    """
+    같은 라운드 안의 재전송 + 직전 라운드 채팅 재전송을 make_chat_handler에 넣어
+    라운드별 get_current_votes()가 깨끗한 스트림 결과와 같고, 중복 차단 수(hits)가
+    넣은 중복 수와 정확히 같은지 확인 (VirtualClock, 결과가 시드로 결정됨). 통과 시 True.
+    """
+    rng = random.Random(seed)
+    options = ["효과1", "효과2", "효과3"]
+    rounds = [_fake_round(rng, 1, chats, voters), _fake_round(rng, 2, chats, voters)]
+    step = 25.0 / chats                              # 투표 창 안에 고르게
+    gap = min(240.0, bot.CHAT_DEDUP_TTL / 2)         # 라운드 간격 (ttl 안)
+
+    # 재전송 스트림: 라운드 안 중복은 바로 뒤/라운드 끝, 라운드 2 앞에는 라운드 1 채팅 일부
+    streams, injected = [], 0
+    for r, fresh in enumerate(rounds):
+        stream = [m for m in rounds[r - 1] if rng.random() < dup_ratio] if r else []
+        tail = []
+        for m in fresh:
+            stream.append(m)
+            roll = rng.random()
+            if roll < dup_ratio / 2:
+                stream.append(dict(m))
+            elif roll < dup_ratio:
+                tail.append(dict(m))
+        stream += tail
+        injected += len(stream) - len(fresh)
+        streams.append(stream)
+
+    def play(feeds, dedup):
+        clock = bot.VirtualClock()
+        chat_dedup = bot.ChatDedupCache(ttl=bot.CHAT_DEDUP_TTL, capacity=bot.CHAT_DEDUP_SIZE,
+                                        clock=clock) if dedup else None
+        flood_gate = bot.VoterFloodGate(window=bot.FLOOD_WINDOW, burst=bot.FLOOD_BURST, clock=clock)
+        results = []
+        for feed in feeds:
+            manager = bot.new_vote_manager(options, clock=clock)
+            on_chat = bot.make_chat_handler(manager, options, flood_gate, chat_dedup)
+            for msg in feed:
+                on_chat(msg)
+                clock.sleep(step)
+            results.append(manager.get_current_votes())
+            clock.sleep(gap)
+        return results, chat_dedup
+
+    clean, _ = play(rounds, dedup=False)
+    got, chat_dedup = play(streams, dedup=True)
+    ok = got == clean and chat_dedup.hits == injected
+    for r, (want, have) in enumerate(zip(clean, got), start=1):
+        print(f"[DEDUP] 라운드 {r}: 깨끗한 스트림 {want} / 재전송 포함 {have}")
+    print("[DEDUP] %s: 넣은 중복 %d건, 차단 %d건" % ("통과" if ok else "실패", injected, chat_dedup.hits))
+    return ok
+
+# ================= 소크 =================
+class _SoakFailure(Exception):
+    pass
+
+def _open_fd_count():
+    """열린 파일 디스크립터 수 (리눅스/맥만, 그 외 None)"""
+    for d in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(d))
+        except OSError:
+            continue
+    return None
+
+def soak(rounds=2000, sample_every=50, warmup=100, time_scale=20.0,
+         mem_tolerance=2 * 1024 * 1024, patience=3, replay=0.0, bot_file=BOT_FILE):
+    """
+    로컬 대역 서버를 상대로 라운드를 배속 실행하며 sample_every 라운드마다
+    tracemalloc/스레드 수/FD 수를 잰다. warmup 이후 기준선보다 허용치 이상 커지거나
+    patience 회 연속 증가하면 실패(1), 아니면 0 반환. 집계가 0표인 라운드가 있어도 실패
+    (대역 채팅이 투표 중에 도착하지 않음 = 집계/도배 차단/찬성 투표/팬아웃 경로를 시험하지 못함).
+    단계 시간은 투표 4초/결과 1초/대기 1초로 줄이고 time_scale 배속으로 돌린다
+    (time.sleep 최소 단위 때문에 배속만으로는 라운드당 수백 번의 sleep이 병목).
+    배속은 실제 투표 창(vote/time_scale)이 세션 연결·공지 왕복보다 넉넉하도록 잡아야
+    대역 채팅이 실제로 집계 경로를 지난다 (100배속이면 창이 40ms라 대부분 마감 뒤 도착).
+    replay > 0 이면 대역 서버가 채팅을 재전송하고, 중복 차단 수가 재전송 수를 넘으면(정상 채팅 오차단) 실패.
+    시작 전에 dedup_check로 최종 득표/차단 수를 먼저 확인한다.
+    """
+    if not os.getenv("CHZZK_LOG"):
+        logging.basicConfig(level=logging.ERROR)  # 미소비 ACK 경고 등 반복 로그 숨김
+    try:
+        bot = load_bot(bot_file)
+    except Exception as e:
+        print(f"[오류] 봇 모듈을 불러올 수 없습니다 ({bot_file}): {e}")
+        return 1
+    if not dedup_check(bot):
+        return 1
+
+    vote_duration, result_duration, cooldown = 4, 1, 1
+    parent_conn, child_conn = multiprocessing.Pipe()
+    # 투표 창(실제 시간)의 절반에 걸쳐 채팅을 나눠 보냄
+    spread = vote_duration / time_scale / 2
+    server = multiprocessing.Process(target=_serve_standin, args=(child_conn, replay, spread), daemon=True)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="chzzk_soak_")
+    settings = bot.RoundSettings(
+        api_base=parent_conn.recv(),
+        transports=["polling"],
+        clock=bot.WallClock(scale=time_scale),
+        vote_duration=vote_duration,
+        result_duration=result_duration,
+        cooldown=cooldown,
+        ack_timeout=1.0,  # 에뮬레이터가 없으므로 미소비 결과는 바로 정리
+        save_dir=workdir,
+        history_db=os.path.join(workdir, "vote_history.sqlite3") if bot.HISTORY_DB else None,
+        fanout_port=None,
+    )
+
+    tracemalloc.start(1)  # 프레임 10개 추적은 모든 할당이 10배 이상 느려져 연결/공지가 라운드를 못 따라감
+    samples = []  # (round, mem, threads, fds)
+    baseline = {"snap": None}
+    failures = []
+    ingest = {"received": 0, "closed": 0, "counted": 0}
+
+    def session_factory(manager, options, flood_gate, on_event, chat_dedup):
+        # 리스너의 on_event 훅으로 수신 채팅을 셈 (집계 경로는 실제 세션 그대로)
+        def count_event(event_type, data):
+            if event_type == "CHAT":
+                ingest["received"] += 1
+                if not manager.voting:
+                    ingest["closed"] += 1
+            if on_event:
+                on_event(event_type, data)
+        return bot.run_session_for_vote(manager, options, flood_gate, count_event, chat_dedup,
+                                        api_base=settings.api_base, transports=settings.transports)
+
+    def _grew(key_idx, tolerance, step):
+        base = samples[0][key_idx]
+        last = samples[-1][key_idx]
+        if base is None or last is None:
+            return False
+        if last - base > tolerance:
+            return True
+        tail = [smp[key_idx] for smp in samples[-(patience + 1):]]
+        return len(tail) == patience + 1 and all(b - a > step for a, b in zip(tail, tail[1:]))
+
+    def on_round_end(n, votes):
+        counted = sum(votes.values())
+        ingest["counted"] += counted
+        if not counted:
+            failures.append((n, "집계 0표 (대역 채팅이 투표 중에 도착하지 않음)"))
+            raise _SoakFailure()
+        if n < warmup or (n - warmup) % sample_every:
+            return
+        gc.collect()
+        mem = tracemalloc.get_traced_memory()[0]
+        smp = (n, mem, threading.active_count(), _open_fd_count())
+        samples.append(smp)
+        print("[SOAK] round=%d mem=%.1fKB threads=%d fds=%s" % (n, mem / 1024, smp[2], smp[3]))
+        if baseline["snap"] is None:
+            baseline["snap"] = tracemalloc.take_snapshot()
+            return
+        for name, idx, tol, step in (("memory", 1, mem_tolerance, 16 * 1024),
+                                     ("threads", 2, 2, 0), ("fds", 3, 4, 0)):
+            if _grew(idx, tol, step):
+                failures.append((n, f"{name} 증가 {samples[0][idx]} → {smp[idx]}"))
+        if failures:
+            raise _SoakFailure()
+
+    chat_dedup = bot.ChatDedupCache(ttl=bot.CHAT_DEDUP_TTL, capacity=bot.CHAT_DEDUP_SIZE, clock=settings.clock)
+    t0 = time.time()
+    try:
+        bot.run_rounds(float("inf"), max_rounds=rounds, on_round_end=on_round_end, chat_dedup=chat_dedup,
+                       session_factory=session_factory, settings=settings)
+    except _SoakFailure:
+        pass
+    finally:
+        parent_conn.send("stop")
+        standin_stats = parent_conn.recv() if parent_conn.poll(5) else {}
+        server.join(timeout=5)
+
+    print("[SOAK] %d 샘플, %.1fs 소요, 작업 폴더 %s" % (len(samples), time.time() - t0, workdir))
+    replayed = standin_stats.get("replayed", 0)
+    print("[SOAK] 대역 채팅 %s건(재전송 %d건 별도) → 수신 %d건(투표 닫힘 %d건), 집계 %d표" % (
+        standin_stats.get("sent", "?"), replayed, ingest["received"], ingest["closed"], ingest["counted"]))
+    print("[SOAK] %s" % chat_dedup.stats())
+    if chat_dedup.hits > replayed:
+        failures.append((rounds, f"중복 차단 {chat_dedup.hits}건이 재전송 {replayed}건보다 많음 (정상 채팅 오차단)"))
+    if not failures:
+        print("[SOAK] 통과: 메모리/스레드/FD 증가 없음")
+        tracemalloc.stop()
+        return 0
+    for n, reason in failures:
+        print(f"[SOAK] 실패: round={n} {reason}")
+    if baseline["snap"] is not None:
+        for stat in tracemalloc.take_snapshot().compare_to(baseline["snap"], "lineno")[:10]:
+            print("   ", stat)
+    tracemalloc.stop()
+    return 1
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="라운드 배속 소크 테스트 (로컬 대역 서버)")
+    ap.add_argument("rounds", type=int, nargs="?", default=2000)
+    ap.add_argument("--sample-every", type=int, default=50)
+    ap.add_argument("--warmup", type=int, default=100)
+    ap.add_argument("--time-scale", type=float, default=20.0)
+    ap.add_argument("--replay", type=float, default=0.0, help="대역 서버 채팅 재전송 비율 (중복 차단 확인)")
+    ap.add_argument("--dedup-check", action="store_true", help="중복 차단 결정적 확인만 실행")
+    ap.add_argument("--seed", type=int, default=0, help="--dedup-check 채팅 시드")
+    ap.add_argument("--bot", default=BOT_FILE)
+    args = ap.parse_args(argv)
+    if args.dedup_check:
+        try:
+            bot = load_bot(args.bot)
+        except Exception as e:
+            print(f"[오류] 봇 모듈을 불러올 수 없습니다 ({args.bot}): {e}")
+            return 1
+        return 0 if dedup_check(bot, seed=args.seed) else 1
+    return soak(args.rounds, args.sample_every, args.warmup, args.time_scale, replay=args.replay, bot_file=args.bot)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,8 +6,10 @@ import time
 import tempfile
 import threading
 import webbrowser
+import secrets
 import requests
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 from urllib.parse import urlencode, urlparse, parse_qs
 
 # ================= 실행 경로/파일 경로 고정 =================
@@ -19,7 +21,9 @@ def get_app_dir():
 APP_DIR = get_app_dir()
 CONFIG_FILE = os.path.join(APP_DIR, "config.json")
 TOKEN_FILE = os.path.join(APP_DIR, "access_token.json")
+IDENTITY_SUFFIX = ".identity.json"  # 봇이 토큰 옆에 두는 채널 확인 캐시 (토큰 파일 아님)
 ERROR_FILE = os.path.join(APP_DIR, "access_token_error.txt")
+TOKEN_URL = "https://openapi.chzzk.naver.com/auth/v1/token"
 
 print("[INFO] APP_DIR     =", APP_DIR)
 print("[INFO] CONFIG_FILE =", CONFIG_FILE)
@@ -68,11 +72,8 @@ def get_config():
     with open(CONFIG_FILE, encoding="utf-8") as f:
         return json.load(f)
 
-def save_token_dual(token_obj: dict):
-    """
-    기존 코드와 호환: top-level와 content에 동일 구조 저장.
-    추가로 obtained_at / expiresIn 보강. 원자적 저장 + mtime 갱신.
-    """
+def _build_token_record(token_obj: dict) -> dict:
+    """top-level + content 이중 구조 + obtained_at / expiresIn 보강"""
     flat = dict(token_obj)
     data = flat.copy()
     data["content"] = flat.copy()
@@ -88,7 +89,14 @@ def save_token_dual(token_obj: dict):
     )
     data["obtained_at"] = obtained_at
     data["expiresIn"] = int(expires_in)
+    return data
 
+def save_token_dual(token_obj: dict):
+    """
+    기존 코드와 호환: top-level와 content에 동일 구조 저장.
+    추가로 obtained_at / expiresIn 보강. 원자적 저장 + mtime 갱신.
+    """
+    data = _build_token_record(token_obj)
     _atomic_json_write(TOKEN_FILE, data)
     print(f"✅ access_token.json 저장 완료! -> {TOKEN_FILE}")
     print("[INFO] mtime:", time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(os.path.getmtime(TOKEN_FILE))))
@@ -346,12 +354,197 @@ def refresh_token():
 
 # ================= 4. 토큰 삭제 =================
 def delete_token():
+    identity_file = os.path.splitext(TOKEN_FILE)[0] + IDENTITY_SUFFIX
+    if os.path.exists(identity_file):
+        os.remove(identity_file)
     if os.path.exists(TOKEN_FILE):
         os.remove(TOKEN_FILE)
         print("✅ access_token.json 삭제 완료!")
     else:
         print("access_token.json 파일이 없습니다.")
 
+# ================= 5. 다채널 일괄 갱신 (비대화형) =================
+def _load_batch_targets(target: str):
+    """
+    폴더면 그 안의 *.json 토큰 파일 전부(파일명 = 채널명),
+    파일이면 매니페스트: {"channels": {"채널": "경로" | {"path": ...}}} 또는 {"채널": "경로"} 또는 ["경로", ...]
+    상대 경로는 매니페스트 위치 기준. [(채널, 경로)] 반환
+    """
+    if os.path.isdir(target):
+        return [
+            (os.path.splitext(name)[0], os.path.join(target, name))
+            for name in sorted(os.listdir(target))
+            if name.endswith(".json") and not name.startswith(".") and not name.endswith(IDENTITY_SUFFIX)
+        ]
+    with open(target, encoding="utf-8") as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(target))
+    if isinstance(manifest, dict):
+        entries = manifest.get("channels", manifest)
+        items = entries.items()
+    else:
+        items = ((os.path.splitext(os.path.basename(p))[0], p) for p in manifest)
+    targets = []
+    for name, entry in items:
+        path = entry.get("path") if isinstance(entry, dict) else entry
+        if path:
+            targets.append((name, path if os.path.isabs(path) else os.path.join(base, path)))
+    return targets
+
+def _token_expires_at(token: dict):
+    try:
+        return int(token["obtained_at"]) + int(token["expiresIn"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _refresh_one(session, cfg, name, path, skew, force, token_url):
+    result = {"channel": name, "path": path, "status": "failed", "detail": "", "expires_at": None}
+    try:
+        with open(path, encoding="utf-8") as f:
+            token = json.load(f)
+    except Exception as e:
+        result["detail"] = f"읽기 실패: {e}"
+        return result
+
+    expires_at = _token_expires_at(token)
+    result["expires_at"] = expires_at
+    if not force and expires_at is not None and expires_at - time.time() > skew:
+        result["status"] = "skipped"
+        result["detail"] = f"만료까지 {int(expires_at - time.time())}초"
+        return result
+
+    _, refresh_token_val = extract_access_refresh(token)
+    if not refresh_token_val:
+        result["detail"] = "refreshToken 없음"
+        return result
+
+    data = {
+        "grantType": "refresh_token",
+        "clientId": cfg.get("client_id"),
+        "clientSecret": cfg.get("client_secret"),
+        "refreshToken": refresh_token_val,
+    }
+    try:
+        res = session.post(token_url, json=data, timeout=20)
+        if res.status_code != 200:
+            result["detail"] = f"HTTP {res.status_code} {res.text[:120]}"
+            return result
+        body = res.json()
+        token_obj = body.get("content", body)
+        if not token_obj.get("accessToken"):
+            result["detail"] = "응답에 accessToken 없음"
+            return result
+        record = _build_token_record(token_obj)
+        _atomic_json_write(path, record)
+        result["status"] = "refreshed"
+        result["expires_at"] = _token_expires_at(record)
+    except Exception as e:
+        result["detail"] = f"예외: {e}"
+    return result
+
+def refresh_tokens_batch(target: str, workers: int = 8, skew: int = 600, force: bool = False,
+                         token_url: str = TOKEN_URL, cfg: dict | None = None):
+    """
+    폴더/매니페스트의 채널별 토큰 파일을 동시에 갱신.
+    - 만료까지 skew초 넘게 남은 토큰은 건너뜀 (force=True면 전부 갱신)
+    - 하나의 Session(커넥션 풀 = workers)을 워커들이 공유
+    - 결과 파일은 _atomic_json_write로 교체
+    """
+    cfg = get_config() if cfg is None else cfg
+    targets = _load_batch_targets(target)
+    if not targets:
+        print("❌ 갱신할 토큰 파일이 없습니다:", target)
+        return []
+
+    workers = max(1, min(workers, len(targets)))
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Content-Type": "application/json"})
+
+    print(f"토큰 일괄 갱신: {len(targets)}개 채널, 동시 {workers}개")
+    t0 = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(
+                lambda nt: _refresh_one(session, cfg, nt[0], nt[1], skew, force, token_url), targets))
+    finally:
+        session.close()
+
+    marks = {"refreshed": "✅", "skipped": "⏭️", "failed": "❌"}
+    for r in results:
+        exp = time.strftime("%m-%d %H:%M", time.localtime(r["expires_at"])) if r["expires_at"] else "-"
+        print(f"{marks[r['status']]} {r['channel']:<20} {r['status']:<9} 만료 {exp}  {r['detail']}")
+    counts = {k: sum(1 for r in results if r["status"] == k) for k in marks}
+    print(f"[요약] 갱신 {counts['refreshed']} / 건너뜀 {counts['skipped']} / 실패 {counts['failed']} "
+          f"({time.time() - t0:.2f}초)")
+    return results
+
+# ================= 로컬 대역 토큰 엔드포인트 (오프라인 테스트용) =================
+class _StandInTokenHandler(BaseHTTPRequestHandler):
+    """POST /auth/v1/token (refresh_token) 에 새 토큰을 발급. refreshToken이 "invalid"면 401"""
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = {}
+        if urlparse(self.path).path != "/auth/v1/token" or body.get("grantType") != "refresh_token":
+            self._reply(400, {"code": 400, "message": "bad request"})
+        elif not body.get("refreshToken") or body.get("refreshToken") == "invalid":
+            self._reply(401, {"code": 401, "message": "invalid refresh token"})
+        else:
+            self._reply(200, {"code": 200, "content": {
+                "accessToken": "standin-" + secrets.token_hex(8),
+                "refreshToken": "standin-" + secrets.token_hex(8),
+                "tokenType": "Bearer",
+                "expiresIn": 86400,
+            }})
+
+    def _reply(self, status, obj):
+        raw = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+def run_standin_token_endpoint(host: str = "127.0.0.1", port: int = 0):
+    """대역 토큰 서버를 백그라운드로 띄우고 (server, token_url) 반환"""
+    server = ThreadingHTTPServer((host, port), _StandInTokenHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}/auth/v1/token"
+
+def batch_main(argv):
+    import argparse
+    ap = argparse.ArgumentParser(description="채널별 토큰 파일 일괄 갱신 (비대화형)")
+    ap.add_argument("--batch", required=True, metavar="DIR_OR_MANIFEST")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--skew", type=int, default=600, help="만료까지 남은 시간이 이 값(초) 이하일 때만 갱신")
+    ap.add_argument("--force", action="store_true", help="만료 여부와 상관없이 전부 갱신")
+    ap.add_argument("--token-url", default=TOKEN_URL)
+    ap.add_argument("--standin", action="store_true", help="로컬 대역 토큰 엔드포인트로 갱신 (오프라인 테스트)")
+    args = ap.parse_args(argv)
+
+    server = None
+    token_url = args.token_url
+    cfg = None
+    if args.standin:
+        server, token_url = run_standin_token_endpoint()
+        cfg = get_config() if os.path.exists(CONFIG_FILE) else {"client_id": "standin", "client_secret": "standin"}
+        print("[INFO] 대역 토큰 엔드포인트:", token_url)
+    try:
+        results = refresh_tokens_batch(args.batch, args.workers, args.skew, args.force, token_url, cfg)
+    finally:
+        if server:
+            server.shutdown()
+    return 1 if any(r["status"] == "failed" for r in results) or not results else 0
+
 # ================= 메뉴 =================
 def menu():
     print("\n====== 치지직 토큰 관리 (통합) ======")
@@ -364,6 +557,8 @@ def menu():
 
 # ================= 메인 실행 =================
 if __name__ == "__main__":
+    if "--batch" in sys.argv:
+        sys.exit(batch_main(sys.argv[1:]))
     while True:
         try:
             menu()